@@ -6,7 +6,9 @@ import argparse
 from myfpga.synthesis import Design
 from myfpga.implementation import Implementation
 from myfpga.simulation import Simulator
-from myfpga.routing import DeviceTopology, route_design
+from myfpga.placement import AnnealingSchedule
+from myfpga.routing import DeviceTopology, RoutedDesign, route_design
+from myfpga.verification import check_equivalence
 
 
 # Process:
@@ -36,6 +38,11 @@ def run(args):
         design = Design.load(f)
 
     implementation = Implementation(design)
+    if not args.skip_equivalence_check:
+        mismatch = check_equivalence(implementation)
+        if mismatch is not None:
+            print(f'Implementation does not match the design. {mismatch}')
+            return 1
     # simulator = MyDesignSimulator(implementation)
 
     # for i in range(16):
@@ -46,14 +53,67 @@ def run(args):
     #     data = simulator.get_output('o_Data')
     #     print(f'Clock {i+1}: o_Data = {data}')
 
+    previous = None
+    if args.previous is not None:
+        with open(args.previous, 'r') as f:
+            previous = RoutedDesign.load(f)
+
     device_topology = DeviceTopology(width=4, height=4)
-    routed_design = route_design(implementation, device_topology)
+    routed_design = route_design(
+        implementation,
+        device_topology,
+        previous,
+        seeds=range(args.seed, args.seed + args.chains),
+        workers=args.workers,
+        placement_schedule=AnnealingSchedule(time_limit=args.time_limit),
+        checkpoint_path=args.checkpoint,
+        resume=args.resume,
+    )
+
+    if routed_design is not None and args.output is not None:
+        with open(args.output, 'w') as f:
+            routed_design.save(f)
 
 
 def main():
     parser = argparse.ArgumentParser(description='myfpga synthesis toolchain')
     parser.add_argument('design_file')
+    parser.add_argument('-o', '--output', help='save the placed and routed design')
+    parser.add_argument(
+        '--previous',
+        help='placed and routed design of an earlier version to reuse where unchanged',
+    )
+    parser.add_argument(
+        '--chains', type=int, default=1,
+        help='number of annealing chains to run, keeping the best placement',
+    )
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='random seed of the first annealing chain (the rest follow on)',
+    )
+    parser.add_argument(
+        '-j', '--workers', type=int, default=1,
+        help='number of processes to anneal and route with',
+    )
+    parser.add_argument(
+        '--time-limit', type=float,
+        help='maximum number of seconds to anneal each placement for',
+    )
+    parser.add_argument(
+        '--checkpoint',
+        help='periodically save progress to this file',
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='carry on from the checkpoint file, if it exists',
+    )
+    parser.add_argument(
+        '--skip-equivalence-check', action='store_true',
+        help='do not simulate the implementation against the design',
+    )
     args = parser.parse_args()
+    if args.resume and args.checkpoint is None:
+        parser.error('--resume requires --checkpoint')
     sys.exit(run(args))
 
 
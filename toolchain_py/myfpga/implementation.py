@@ -133,7 +133,7 @@ class Implementation:
             return logic_cell
         elif isinstance(node, FlipFlop):
             # ... or with a passthrough LUT.
-            PASSTHROUGH_CONFIG = 0x1010101010101010  # assume port 0 for the connection
+            PASSTHROUGH_CONFIG = 0b1010101010101010  # assume port 0 for the connection
             lut = LookUpTable(name='!passthrough_lut', config=PASSTHROUGH_CONFIG)
             logic_cell = LogicCell(lut=lut, ff=node)
             node_replacements[node] = logic_cell
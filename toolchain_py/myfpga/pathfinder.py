@@ -1,15 +1,27 @@
 """Implement the PathFinder negotiated congestion router."""
 
+import math
+import time
 import heapq
-
-import networkx as nx
+import bisect
+from typing import Optional
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
 
 
 class PriorityQueue:
 
+    """Minimum priority queue with decrease-key by lazy deletion.
+
+    Pushing an item which is already queued at a higher priority moves it
+    to the new priority. The superseded heap entry is left in place and
+    skipped when it reaches the top of the heap.
+
+    """
+
     def __init__(self, items=None):
         self.items = []
-        self._itemset = set()
+        self._priorities = {}
         self._counter = 0
 
         if items is not None:
@@ -17,97 +29,306 @@ class PriorityQueue:
                 self.push(item, priority=0)
 
     def __bool__(self):
-        return bool(self.items)
+        return bool(self._priorities)
 
     def __len__(self):
-        return len(self.items)
+        return len(self._priorities)
 
     def __contains__(self, item):
-        return item in self._itemset
+        return item in self._priorities
 
     def push(self, item, *, priority):
+        """Queue an item, or lower its priority if it is already queued.
+
+        Returns whether the queue was changed.
+
+        """
+        current_priority = self._priorities.get(item)
+        if current_priority is not None and current_priority <= priority:
+            return False
         heapq.heappush(self.items, (priority, self._counter, item))
-        self._itemset.add(item)
+        self._priorities[item] = priority
         self._counter += 1
+        return True
 
     def pop(self):
-        _priority, _counter, item = heapq.heappop(self.items)
-        self._itemset.remove(item)
-        return item
+        while True:
+            priority, _counter, item = heapq.heappop(self.items)
+            if self._priorities.get(item) == priority:
+                del self._priorities[item]
+                return item
 
     def __repr__(self):
         return f'{self.__class__.__name__}({self.items!r})'
 
 
-def route(graph, nets):  # noqa: C901
-    historical_use_cost = {node: 0 for node in graph}
-    base_cost = {node: 1 for node in graph}
+class RoutingError(RuntimeError):
 
-    # Note that this only computes negotiated congestion cost.
-    # A future enhancement can add delay cost as well for a complete
-    # PathFinder implementation.
-    def cost_function(node):
-        return (base_cost[node] + historical_use_cost[node]) * present_use_cost[node]
-
-    def edge_weight(start, end, attrs):
-        return cost_function(end) + attrs['cost']
-
-    routes = {}
-
-    shared_resources_exist = True
-    while shared_resources_exist:
-        present_use_cost = {node: 1 for node in graph}
-
-        # TODO: Improve perfomrance by only re-routing signals which
-        # have shared resources.
-
-        for source, sinks in nets.items():
-            # We begin by looking at the source node.
-            # For each sink connected to the source, we consider a "routing
-            # tree" (which is really just a set) of nodes in the net connecting
-            # the source and sinks.
-            routing_tree = {source}
-            for sink in sinks:
-                # We have to find a way to connect each sink to the routing tree.
-                queue = PriorityQueue(routing_tree)
-                seen_nodes = set()
-                while True:
-                    # Look at the most promising (lowest cost) node in the queue.
-                    node = queue.pop()
-                    seen_nodes.add(node)
-                    # If the node is the sink we're looking for,
-                    # we trace back the path to the source and add each node
-                    # to the routing tree.
-                    if node == sink:
-                        path = nx.dijkstra_path(graph, source, sink, weight=edge_weight)
-                        for path_node in path[1:-1]:
-                            routing_tree.add(path_node)
-                        break
-                    else:
-                        # If it's not the sink we're looking for,
-                        # then we add each node that this node can connect to.
-                        # They are added to the priority queue so that the next
-                        # node we look at is the lowest cost potential path
-                        # to the sink.
-                        for _start, end, path_cost in graph.out_edges(node, data='cost'):
-                            if end not in queue and end not in seen_nodes:
-                                queue.push(end, priority=cost_function(node) + path_cost)
-
-            # Increment the present use cost for all of the nodes that
-            # we're using.
-            for node in routing_tree:
-                present_use_cost[node] += 1
-            routes[source] = routing_tree
-
-        # The starting value is 1, and is increased by 1 for each user of the resource.
-        #  present_use_cost = 1 : unused
-        #  present_use_cost = 2 : exclusively used by one net
-        #  present_use_cost > 2 : shared by multiple nets
-        shared_resources_exist = any(value > 2 for value in present_use_cost.values())
-
-        # Increase the historical use cost for all used nodes by the amount used.
-        for key, value in present_use_cost.items():
-            historical_use_cost[key] += value
+    """Raised when nets cannot be routed without sharing resources.
+
+    `overused_nodes` maps each node ID which is still shared
+    to the source node IDs of the nets using it.
+
+    """
+
+    def __init__(self, message, overused_nodes=None):
+        super().__init__(message)
+        self.overused_nodes = overused_nodes or {}
+
+
+@dataclass
+class NegotiationSchedule:
+
+    """Controls how quickly PathFinder drives nets apart.
+
+    The present use cost of a node is `1 + present_factor * occupancy`,
+    where the present factor starts at `initial_present_factor` and is
+    multiplied by `present_factor_multiplier` after each iteration.
+    Each net using a node at the end of an iteration adds `history_factor`
+    to the node's historical use cost.
+    Routing fails after `max_iterations` if nodes are still shared,
+    or never if it is None.
+
+    """
+
+    initial_present_factor: float = 1
+    present_factor_multiplier: float = 1.5
+    history_factor: float = 1
+    max_iterations: Optional[int] = 50
+
+
+@dataclass
+class IterationStats:
+
+    """Progress of a single PathFinder negotiation iteration."""
+
+    iteration: int
+    overused_nodes: int
+    nets_rerouted: int
+    nodes_expanded: int
+    elapsed: float
+
+
+@dataclass
+class NegotiationState:
+
+    """Where PathFinder negotiation had got to, for resuming it later.
+
+    This holds everything carried from one iteration to the next: the
+    present and historical use costs, the routing tree of each net
+    (including its source but not its sinks), the bounding box of each
+    net's search, and the nets still to be rerouted.
+
+    """
+
+    iteration: int
+    present_factor: float
+    historical_use_cost: list
+    routes: dict
+    bounding_boxes: dict
+    nets_to_route: list
+
+
+def route(graph, nets, *, incremental=True, astar_factor=0,  # noqa: C901
+          bbox_margin=None, workers=1, schedule=None, on_iteration=None,
+          initial_routes=None, on_checkpoint=None, resume=None):
+    """Route each net from its source to all of its sinks.
+
+    The graph is a `RoutingResourceGraph`, and `nets` maps each source node ID
+    to a set of sink node IDs. The result maps each source node ID to the set
+    of node IDs in its routed net.
+
+    Nets are negotiated until no routing resource is shared between them,
+    following the given `NegotiationSchedule` (or the default one).
+    A `RoutingError` reporting the shared nodes is raised if the schedule
+    runs out of iterations. After each iteration `on_iteration` is called
+    with its `IterationStats`, if given.
+
+    Routes returned by an earlier call can be passed as `initial_routes`
+    for nets whose source and sinks have not changed since. These nets are
+    treated as already routed, and are only rerouted if they turn out to
+    share resources with other nets.
+
+    After each iteration which leaves nets to reroute, `on_checkpoint` is
+    called with a `NegotiationState`, if given. The state refers to the
+    router's own data, so it must be saved or copied before returning.
+    Passing a saved state as `resume` to a call with the same graph,
+    nets and options carries on negotiating from that iteration.
+
+    When `incremental` is set, only nets which use an overused resource are
+    ripped up and rerouted on each iteration; nets with legal routes are kept.
+    Otherwise every net is rerouted on every iteration.
+
+    When `astar_factor` is nonzero the search for each sink is directed
+    towards it by the Manhattan distance between the node positions,
+    scaled by the least cost of moving one unit (the graph's `distance_cost`)
+    and by the factor itself.
+    A factor of 1 never overestimates the remaining cost, so routes are as
+    cheap as with an undirected search. Larger factors expand fewer nodes
+    at the expense of route quality.
+
+    When `bbox_margin` is given, the search for each net is confined to the
+    bounding box of its source and sinks, grown by the margin on each side.
+    If a sink cannot be reached within the box it is widened until it can.
+
+    With more than one worker, nets are split by their bounding boxes into
+    vertical strips of the device which are routed concurrently in worker
+    processes. Every search in a strip, including any widening of its
+    bounding box, is confined to the strip, so that the batches never
+    claim the same nodes. Nets which cross a strip boundary, or cannot be
+    routed within their strip, are routed afterwards in this process.
+    The result only depends on the nets and the number of workers, not on
+    the order in which the workers finish.
+
+    """
+    if schedule is None:
+        schedule = NegotiationSchedule()
+    if resume is None:
+        present_factor = schedule.initial_present_factor
+        historical_use_cost = [0] * len(graph)
+    else:
+        present_factor = resume.present_factor
+        historical_use_cost = list(resume.historical_use_cost)
+
+    # Number of nets currently using each node. This is kept up to date as
+    # nets are ripped up and rerouted so that it carries across iterations.
+    occupancy = [0] * len(graph)
+
+    # Each net's search is confined to its bounding box, if it has one.
+    # Boxes which had to be widened stay wider for later iterations.
+    if resume is not None:
+        bounding_boxes = dict(resume.bounding_boxes)
+    elif bbox_margin is None:
+        bounding_boxes = {}
+    else:
+        bounding_boxes = {
+            source: _grow(_bounding_box(graph, {source} | sinks), bbox_margin)
+            for source, sinks in nets.items()
+        }
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(graph,),
+        )
+    else:
+        executor = None
+
+    if resume is None:
+        routes = {}
+        for source, nodes in (initial_routes or {}).items():
+            routes[source] = set(nodes) - nets[source]
+        nets_to_route = [source for source in nets if source not in routes]
+        iteration = 0
+    else:
+        routes = {source: set(nodes) for source, nodes in resume.routes.items()}
+        nets_to_route = list(resume.nets_to_route)
+        iteration = resume.iteration
+    for routing_tree in routes.values():
+        _commit(routing_tree, occupancy)
+
+    try:
+        while nets_to_route:
+            iteration += 1
+            start_time = time.perf_counter()
+            nodes_expanded = 0
+
+            if executor is None:
+                batches, remaining_nets = [], nets_to_route
+            else:
+                batches, remaining_nets = _partition_nets(
+                    graph, nets, nets_to_route, workers, bounding_boxes)
+
+            # Each batch is routed against the occupancy at the start of the
+            # iteration, then all of the results are merged in batch order.
+            futures = [
+                executor.submit(
+                    _route_batch,
+                    {source: nets[source] for source in batch},
+                    {source: routes[source] for source in batch if source in routes},
+                    occupancy,
+                    historical_use_cost,
+                    present_factor,
+                    astar_factor,
+                    {
+                        source: bounding_boxes[source]
+                        for source in batch if source in bounding_boxes
+                    },
+                    strip,
+                )
+                for batch, strip in batches
+            ]
+            for future in futures:
+                (batch_routes, batch_nodes_expanded, batch_bounding_boxes,
+                 unrouted_nets) = future.result()
+                for source, routing_tree in batch_routes.items():
+                    _rip_up(routes.get(source, ()), occupancy)
+                    _commit(routing_tree, occupancy)
+                    routes[source] = routing_tree
+                nodes_expanded += batch_nodes_expanded
+                bounding_boxes.update(batch_bounding_boxes)
+                remaining_nets.extend(unrouted_nets)
+
+            remaining_routes, remaining_nodes_expanded, _unrouted_nets = _route_nets(
+                graph,
+                {source: nets[source] for source in remaining_nets},
+                routes,
+                occupancy,
+                historical_use_cost,
+                present_factor,
+                astar_factor,
+                bounding_boxes,
+            )
+            routes.update(remaining_routes)
+            nodes_expanded += remaining_nodes_expanded
+
+            # Increase the historical use cost for all used nodes by the amount used.
+            overused_nodes = set()
+            for routing_tree in routes.values():
+                for node in routing_tree:
+                    historical_use_cost[node] += schedule.history_factor
+                    if occupancy[node] > 1:
+                        overused_nodes.add(node)
+            present_factor *= schedule.present_factor_multiplier
+
+            if on_iteration is not None:
+                on_iteration(IterationStats(
+                    iteration=iteration,
+                    overused_nodes=len(overused_nodes),
+                    nets_rerouted=len(nets_to_route),
+                    nodes_expanded=nodes_expanded,
+                    elapsed=time.perf_counter() - start_time,
+                ))
+
+            out_of_iterations = (
+                schedule.max_iterations is not None
+                and iteration >= schedule.max_iterations
+            )
+            if not overused_nodes:
+                nets_to_route = []
+            elif out_of_iterations:
+                raise _overuse_error(graph, routes, overused_nodes, iteration)
+            elif incremental:
+                nets_to_route = [
+                    source for source, routing_tree in routes.items()
+                    if not overused_nodes.isdisjoint(routing_tree)
+                ]
+            else:
+                nets_to_route = list(nets)
+
+            if nets_to_route and on_checkpoint is not None:
+                on_checkpoint(NegotiationState(
+                    iteration=iteration,
+                    present_factor=present_factor,
+                    historical_use_cost=historical_use_cost,
+                    routes=routes,
+                    bounding_boxes=bounding_boxes,
+                    nets_to_route=nets_to_route,
+                ))
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     # Finally, add the source and sinks to the routing tree to form
     # a completely routed net list.
@@ -115,3 +336,307 @@ def route(graph, nets):  # noqa: C901
         source: nodes | {source} | nets[source]
         for source, nodes in routes.items()
     }
+
+
+def route_net(graph, source, sinks, *, astar_factor=0, bbox_margin=None):
+    """Route a single net as if it were alone on the device.
+
+    There is no negotiation with other nets, so this is much cheaper than
+    `route` and suitable for estimating the cost of a net during placement.
+    The options are the same as for `route`. Returns the set of node IDs
+    in the routed net.
+
+    """
+    if astar_factor:
+        lookahead = _manhattan_lookahead(graph, astar_factor)
+    else:
+        lookahead = _no_lookahead
+
+    if bbox_margin is None:
+        bounding_box = None
+    else:
+        bounding_box = _grow(_bounding_box(graph, {source} | sinks), bbox_margin)
+
+    routing_tree, _nodes_expanded, _widened_bounding_box = _route_net(
+        graph, source, sinks, graph.base_costs.__getitem__, lookahead, bounding_box)
+    return routing_tree | sinks
+
+
+def _overuse_error(graph, routes, overused_nodes, iteration):
+    users = {node: [] for node in overused_nodes}
+    for source, routing_tree in routes.items():
+        for node in overused_nodes.intersection(routing_tree):
+            users[node].append(source)
+
+    lines = [f'{len(users)} routing nodes still shared after {iteration} iterations:']
+    for node, sources in sorted(users.items()):
+        lines.append(f'  {graph.nodes[node]} used by {len(sources)} nets')
+    return RoutingError('\n'.join(lines), users)
+
+
+def _rip_up(routing_tree, occupancy):
+    for node in routing_tree:
+        occupancy[node] -= 1
+
+
+def _commit(routing_tree, occupancy):
+    for node in routing_tree:
+        occupancy[node] += 1
+
+
+def _route_nets(graph, nets, routes, occupancy, historical_use_cost,
+                present_factor, astar_factor, bounding_boxes, strip=None):
+    """Rip up and reroute nets one after another.
+
+    The occupancy and any widened bounding boxes are updated in place
+    as each net is rerouted.
+    If a `strip` of the device is given, every search is confined to it,
+    including those of nets without a bounding box. Nets which cannot be
+    routed within the strip keep their old routes.
+    Returns the new routing tree of each net, the number of nodes
+    expanded while searching for them and the nets which were left
+    unrouted.
+
+    """
+    base_cost = graph.base_costs
+
+    # Note that this only computes negotiated congestion cost.
+    # A future enhancement can add delay cost as well for a complete
+    # PathFinder implementation.
+    def cost_function(node):
+        # The present use cost is 1 for an unused node, 2 for a node used
+        # by one net, and greater when it is shared.
+        present_use_cost = 1 + present_factor * occupancy[node]
+        return (base_cost[node] + historical_use_cost[node]) * present_use_cost
+
+    if astar_factor:
+        lookahead = _manhattan_lookahead(graph, astar_factor)
+    else:
+        lookahead = _no_lookahead
+
+    new_routes = {}
+    nodes_expanded = 0
+    unrouted_nets = []
+    for source, sinks in nets.items():
+        old_routing_tree = routes.get(source, ())
+        _rip_up(old_routing_tree, occupancy)
+        try:
+            routing_tree, net_nodes_expanded, bounding_box = _route_net(
+                graph, source, sinks, cost_function, lookahead,
+                bounding_boxes.get(source, strip), strip)
+        except RoutingError:
+            if strip is None:
+                raise
+            _commit(old_routing_tree, occupancy)
+            unrouted_nets.append(source)
+            continue
+        if source in bounding_boxes:
+            bounding_boxes[source] = bounding_box
+        _commit(routing_tree, occupancy)
+        new_routes[source] = routing_tree
+        nodes_expanded += net_nodes_expanded
+    return new_routes, nodes_expanded, unrouted_nets
+
+
+# The routing resource graph of a worker process, which is sent to each
+# worker once when it starts rather than with every batch of nets.
+_worker_graph = None
+
+
+def _init_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _route_batch(nets, routes, occupancy, historical_use_cost,
+                 present_factor, astar_factor, bounding_boxes, strip):
+    new_routes, nodes_expanded, unrouted_nets = _route_nets(
+        _worker_graph, nets, routes, occupancy, historical_use_cost,
+        present_factor, astar_factor, bounding_boxes, strip)
+    return new_routes, nodes_expanded, bounding_boxes, unrouted_nets
+
+
+def _bounding_box(graph, node_ids):
+    xs = [graph.xs[node_id] for node_id in node_ids]
+    ys = [graph.ys[node_id] for node_id in node_ids]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _grow(bounding_box, margin):
+    x0, y0, x1, y1 = bounding_box
+    return x0 - margin, y0 - margin, x1 + margin, y1 + margin
+
+
+def _widen(graph, bounding_box, limit=None):
+    """Grow a bounding box to about twice its size, within the limit.
+
+    The limit is a box which defaults to the whole device.
+    Returns None if the box already covers the limit.
+
+    """
+    if limit is None:
+        limit = _bounding_box(graph, range(len(graph)))
+    dx0, dy0, dx1, dy1 = limit
+    x0, y0, x1, y1 = bounding_box
+    if x0 <= dx0 and y0 <= dy0 and x1 >= dx1 and y1 >= dy1:
+        return None
+    margin = max(1, (x1 - x0) / 2, (y1 - y0) / 2)
+    x0, y0, x1, y1 = _grow(bounding_box, margin)
+    return max(x0, dx0), max(y0, dy0), min(x1, dx1), min(y1, dy1)
+
+
+def _partition_nets(graph, nets, sources, batch_count, bounding_boxes):
+    """Split nets into batches which can be routed independently.
+
+    The device is divided into vertical strips holding roughly the same
+    number of nets. Each net whose bounding box lies strictly within a strip
+    is put in that strip's batch. Returns each batch with the box of its
+    strip, which holds no node of any other strip, and the nets which span
+    more than one strip.
+
+    """
+    bounding_boxes = {
+        source: (
+            bounding_boxes.get(source)
+            or _bounding_box(graph, {source} | nets[source])
+        )
+        for source in sources
+    }
+    centers = sorted((x0 + x1) / 2 for x0, _y0, x1, _y1 in bounding_boxes.values())
+    boundaries = [
+        centers[len(centers) * i // batch_count]
+        for i in range(1, batch_count)
+    ]
+
+    batches = [[] for _ in range(batch_count)]
+    remaining_nets = []
+    for source in sources:
+        x0, _y0, x1, _y1 = bounding_boxes[source]
+        first_strip = bisect.bisect_left(boundaries, x0)
+        last_strip = bisect.bisect_right(boundaries, x1)
+        if first_strip == last_strip:
+            batches[first_strip].append(source)
+        else:
+            remaining_nets.append(source)
+
+    # A strip runs between the node positions either side of its boundaries,
+    # leaving out any nodes which are on a boundary.
+    positions = sorted(set(graph.xs))
+    _x0, y0, _x1, y1 = _bounding_box(graph, range(len(graph)))
+    strips = []
+    for i in range(batch_count):
+        first = 0 if i == 0 else bisect.bisect_right(positions, boundaries[i - 1])
+        last = (
+            len(positions) if i == batch_count - 1
+            else bisect.bisect_left(positions, boundaries[i]))
+        strips.append((positions[first], y0, positions[last - 1], y1))
+    return [
+        (batch, strip) for batch, strip in zip(batches, strips) if batch
+    ], remaining_nets
+
+
+def _no_lookahead(node, sink):
+    return 0
+
+
+def _manhattan_lookahead(graph, astar_factor):
+    xs, ys = graph.xs, graph.ys
+    distance_cost = astar_factor * graph.distance_cost
+
+    def lookahead(node, sink):
+        distance = abs(xs[node] - xs[sink]) + abs(ys[node] - ys[sink])
+        # Sources and sinks may be up to one unit away from the switch
+        # blocks which connect them, so allow for that at both ends.
+        return distance_cost * max(0, distance - 2)
+
+    return lookahead
+
+
+def _route_net(graph, source, sinks, cost_function, lookahead, bounding_box,
+               limit=None):
+    """Connect a source to each of its sinks.
+
+    Returns the routing tree, the number of nodes expanded and the
+    bounding box, which may have been widened to reach every sink,
+    but never beyond `limit` if it is given.
+
+    """
+    # We begin by looking at the source node.
+    # For each sink connected to the source, we consider a "routing
+    # tree" (which is really just a set) of nodes in the net connecting
+    # the source and sinks.
+    routing_tree = {source}
+    nodes_expanded = 0
+    for sink in sinks:
+        while True:
+            path, path_nodes_expanded = _find_path(
+                graph, routing_tree, sink, sinks, cost_function, lookahead, bounding_box)
+            nodes_expanded += path_nodes_expanded
+            if path is not None:
+                break
+            if bounding_box is not None:
+                bounding_box = _widen(graph, bounding_box, limit)
+            if bounding_box is None:
+                raise RoutingError(
+                    f'No path from {graph.nodes[source]} to {graph.nodes[sink]}')
+        routing_tree.update(path)
+    return routing_tree, nodes_expanded, bounding_box
+
+
+def _find_path(graph, routing_tree, sink, sinks, cost_function, lookahead,  # noqa: C901
+               bounding_box):
+    """Find the cheapest path from the routing tree to the sink.
+
+    Returns the nodes of the path which are not already in the tree,
+    excluding the sink itself, or None if there is no path within the
+    bounding box. The number of nodes expanded is returned as well.
+
+    """
+    if bounding_box is not None:
+        x0, y0, x1, y1 = bounding_box
+        xs, ys = graph.xs, graph.ys
+
+    # Every node already in the tree is a starting point at no cost,
+    # so later sinks can branch off of wiring used by earlier ones.
+    # Nodes are prioritized by the cost of the path to them plus the
+    # estimated cost of the rest of the path to the sink.
+    queue = PriorityQueue()
+    path_costs = {}
+    predecessors = {}
+    for node in routing_tree:
+        path_costs[node] = 0
+        queue.push(node, priority=lookahead(node, sink))
+
+    nodes_expanded = 0
+    while queue:
+        # Look at the most promising (lowest cost) node in the queue.
+        node = queue.pop()
+        nodes_expanded += 1
+        if node == sink:
+            break
+
+        # If it's not the sink we're looking for, then we consider each
+        # node that this node can connect to. We remember how we reached
+        # a node whenever we find a cheaper path to it, so that the
+        # path can be traced back once the sink is found.
+        for end, edge_cost in graph.out_edges(node):
+            if end in routing_tree or (end in sinks and end != sink):
+                continue
+            if bounding_box is not None and not (
+                    x0 <= xs[end] <= x1 and y0 <= ys[end] <= y1):
+                continue
+            path_cost = path_costs[node] + cost_function(end) + edge_cost
+            if path_cost < path_costs.get(end, math.inf):
+                path_costs[end] = path_cost
+                predecessors[end] = node
+                queue.push(end, priority=path_cost + lookahead(end, sink))
+    else:
+        return None, nodes_expanded
+
+    # Trace back the path from the sink until it joins the routing tree.
+    path = []
+    node = predecessors[sink]
+    while node not in routing_tree:
+        path.append(node)
+        node = predecessors[node]
+    return path, nodes_expanded
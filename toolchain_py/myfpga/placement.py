@@ -0,0 +1,572 @@
+"""Placement state and cost models for annealing placements."""
+
+import math
+import random
+import itertools
+from array import array
+from typing import Optional
+from dataclasses import dataclass
+
+from myfpga.synthesis import ModulePort
+from myfpga.implementation import LogicCell
+
+
+class Placement:
+
+    """Assignment of cells to sites, held in integer arrays.
+
+    Cells and sites are numbered by their index in `cells` and `sites`.
+    `cell_sites[i]` is the site of cell `i`, and `site_cells[j]` is the cell
+    at site `j`, or -1 if the site is empty. Swapping the contents of two
+    sites only updates these arrays, and copying a placement only copies
+    them: the cell and site lists and their indexes are shared.
+
+    """
+
+    def __init__(self, cells, sites, cell_sites, site_cells, cell_ids, site_ids):
+        self.cells = cells
+        self.sites = sites
+        self.cell_sites = cell_sites
+        self.site_cells = site_cells
+        self.cell_ids = cell_ids
+        self.site_ids = site_ids
+
+    @classmethod
+    def from_dict(cls, placement, cells):
+        """Convert a map of every site to the cell placed there (or None).
+
+        `cells` lists the placed cells in the order to number them by.
+
+        """
+        sites = list(placement)
+        site_ids = {site: j for j, site in enumerate(sites)}
+        cell_ids = {cell: i for i, cell in enumerate(cells)}
+        cell_sites = array('i', [-1]) * len(cells)
+        site_cells = array('i', [-1]) * len(sites)
+        for j, site in enumerate(sites):
+            cell = placement[site]
+            if cell is not None:
+                i = cell_ids[cell]
+                cell_sites[i] = j
+                site_cells[j] = i
+        return cls(cells, sites, cell_sites, site_cells, cell_ids, site_ids)
+
+    @classmethod
+    def from_site_cells(cls, cells, sites, site_cells):
+        """Rebuild a placement from the `site_cells` array of another."""
+        cell_sites = array('i', [-1]) * len(cells)
+        for j, i in enumerate(site_cells):
+            if i >= 0:
+                cell_sites[i] = j
+        return cls(
+            cells,
+            sites,
+            cell_sites,
+            array('i', site_cells),
+            {cell: i for i, cell in enumerate(cells)},
+            {site: j for j, site in enumerate(sites)},
+        )
+
+    def to_dict(self):
+        """Convert back to a map of every site to the cell placed there (or None)."""
+        return {
+            site: None if i < 0 else self.cells[i]
+            for site, i in zip(self.sites, self.site_cells)
+        }
+
+    def copy(self):
+        return Placement(
+            self.cells,
+            self.sites,
+            array('i', self.cell_sites),
+            array('i', self.site_cells),
+            self.cell_ids,
+            self.site_ids,
+        )
+
+    def site(self, cell):
+        """Find the site object where a cell object is placed."""
+        return self.sites[self.cell_sites[self.cell_ids[cell]]]
+
+    def cell(self, site_id):
+        """Find the cell object placed at a site ID, or None if it is empty."""
+        i = self.site_cells[site_id]
+        return None if i < 0 else self.cells[i]
+
+    def swap(self, site_id1, site_id2):
+        """Swap the contents of two sites, either of which may be empty."""
+        site_cells = self.site_cells
+        i1, i2 = site_cells[site_id1], site_cells[site_id2]
+        site_cells[site_id1], site_cells[site_id2] = i2, i1
+        if i1 >= 0:
+            self.cell_sites[i1] = site_id2
+        if i2 >= 0:
+            self.cell_sites[i2] = site_id1
+
+
+@dataclass
+class AnnealingSchedule:
+
+    """Controls how a placement is annealed, adapting to the design.
+
+    The initial temperature is `initial_temperature_factor` times the
+    standard deviation of the change in cost over one trial move per cell
+    or port, or `refine_temperature_factor` times it when refining a
+    placement which is already good. Each temperature runs
+    `moves_per_temperature * cells ** (4/3)` moves, after which the
+    temperature is cooled by a factor depending on the fraction of them
+    accepted, as in VPR.
+
+    Annealing stops once the temperature falls below `exit_factor` times
+    the average cost per net. It stops earlier if `time_limit` seconds have
+    passed, if the best cost reaches `target_cost`, or if the best cost has
+    not improved for `stall_temperatures` temperatures at which fewer than
+    15% of moves were accepted. Each limit can be None to disable it,
+    and they are checked after each temperature.
+
+    """
+
+    initial_temperature_factor: float = 20
+    refine_temperature_factor: float = 1
+    moves_per_temperature: float = 1
+    exit_factor: float = 0.005
+    time_limit: Optional[float] = None
+    target_cost: Optional[float] = None
+    stall_temperatures: Optional[int] = 10
+
+    def cooling_factor(self, acceptance):
+        """Find how much to cool by given the fraction of moves accepted."""
+        # Cool slowly in the useful range of temperatures, and skip quickly
+        # through those where nearly every move, or nearly none, is accepted.
+        if acceptance > 0.96:
+            return 0.5
+        elif acceptance > 0.8:
+            return 0.9
+        elif acceptance > 0.15:
+            return 0.95
+        else:
+            return 0.8
+
+
+@dataclass
+class AnnealingProgress:
+
+    """Where an adaptive anneal had got to, for resuming it later.
+
+    Placements are saved as the `site_cells` arrays of the logic cell and
+    module port placements. The random generator's state is saved too,
+    so that a resumed anneal makes the same moves as one which ran through.
+    So is the energy of the current placement, to check that the placement
+    restored from it has exactly the same cost.
+
+    """
+
+    temperature: float
+    temperatures: int
+    stalled_temperatures: int
+    range_limit: float
+    elapsed: float
+    random_state: tuple
+    initial_energy: float
+    energy: float
+    logic_cells: array
+    module_ports: array
+    best_logic_cells: array
+    best_module_ports: array
+
+
+class MoveGenerator:
+
+    """Propose annealing moves within a range which adapts to the temperature.
+
+    Each move takes a random logic cell or module port and swaps it with
+    the contents of another site of the same kind within `range_limit`
+    switch blocks of it, in each direction. The other site may be empty,
+    and is never the same site, so no move is wasted on doing nothing.
+
+    As in VPR, the range limit starts out covering the whole device and
+    is adjusted to keep the fraction of moves accepted near
+    `target_acceptance`. At high temperatures moves span the device,
+    and as it cools they become local.
+
+    Cells and ports in `pinned` never move, and nothing is swapped onto
+    their sites. Only the other cells and ports are counted in `cell_count`.
+
+    """
+
+    def __init__(self, topology, state, *, target_acceptance=0.44, pinned=()):
+        self.target_acceptance = target_acceptance
+        self.max_range_limit = max(topology.width, topology.height)
+        self.range_limit = self.max_range_limit
+
+        self._width = topology.width
+        self._height = topology.height
+        self._logic_cell_sites = state.logic_cells.sites
+        self._logic_cell_site_ids = {
+            (coords.x, coords.y): j
+            for j, coords in enumerate(state.logic_cells.sites)
+        }
+        self._io_block_positions = [
+            topology.node_position(coords) for coords in state.module_ports.sites
+        ]
+
+        # When cells are pinned, the cells and ports which can move, as
+        # (placement, cell index) pairs where placement 0 is the logic cells
+        # and 1 the module ports, and the sites which are not pinned.
+        # These stay the same throughout an anneal.
+        self.cell_count = len(state.logic_cells.cells) + len(state.module_ports.cells)
+        self._movable_cells = None
+        self._open_logic_cell_sites = None
+        self._open_io_block_sites = None
+        if pinned:
+            pinned = set(pinned)
+            placements = (state.logic_cells, state.module_ports)
+            self._movable_cells = [
+                (kind, i)
+                for kind, placement in enumerate(placements)
+                for i, cell in enumerate(placement.cells) if cell not in pinned
+            ]
+            self.cell_count = len(self._movable_cells)
+            self._open_logic_cell_sites = _open_sites(state.logic_cells, pinned)
+            self._open_io_block_sites = set(_open_sites(state.module_ports, pinned))
+
+    def adapt(self, acceptance):
+        """Widen or narrow the range given the fraction of recent moves accepted."""
+        range_limit = self.range_limit * (1 - self.target_acceptance + acceptance)
+        self.range_limit = min(self.max_range_limit, max(1, range_limit))
+
+    def propose(self, state):
+        """Choose a move for a state.
+
+        Returns the placement to change and the IDs of the two sites to swap,
+        or None if the chosen cell or port has nowhere to go.
+
+        """
+        logic_cell_count = len(state.logic_cells.cells)
+        if self._movable_cells is None:
+            i = random.randrange(logic_cell_count + len(state.module_ports.cells))
+        else:
+            kind, i = random.choice(self._movable_cells)
+            i += kind * logic_cell_count
+        if i < logic_cell_count:
+            placement = state.logic_cells
+            site_id = placement.cell_sites[i]
+            other_site_id = self._logic_cell_site_near(placement.sites[site_id])
+        else:
+            placement = state.module_ports
+            site_id = placement.cell_sites[i - logic_cell_count]
+            other_site_id = self._io_block_site_near(site_id)
+        if other_site_id is None:
+            return None
+        return placement, site_id, other_site_id
+
+    def _logic_cell_site_near(self, coords):
+        distance = int(self.range_limit)
+        x0, x1 = max(0, coords.x - distance), min(self._width - 1, coords.x + distance)
+        y0, y1 = max(0, coords.y - distance), min(self._height - 1, coords.y + distance)
+        if self._open_logic_cell_sites is not None:
+            # Pinned cells leave gaps, so check each open site instead.
+            sites = self._logic_cell_sites
+            site_ids = [
+                j for j in self._open_logic_cell_sites
+                if sites[j] != coords
+                and x0 <= sites[j].x <= x1 and y0 <= sites[j].y <= y1
+            ]
+            return random.choice(site_ids) if site_ids else None
+        if x0 == x1 and y0 == y1:
+            return None
+        while True:
+            x, y = random.randint(x0, x1), random.randint(y0, y1)
+            if (x, y) != (coords.x, coords.y):
+                return self._logic_cell_site_ids[x, y]
+
+    def _io_block_site_near(self, site_id):
+        # There are few enough I/O blocks to simply check them all.
+        distance = self.range_limit
+        x0, y0 = self._io_block_positions[site_id]
+        open_site_ids = self._open_io_block_sites
+        site_ids = [
+            other_site_id
+            for other_site_id, (x, y) in enumerate(self._io_block_positions)
+            if other_site_id != site_id
+            and abs(x - x0) <= distance and abs(y - y0) <= distance
+            and (open_site_ids is None or other_site_id in open_site_ids)
+        ]
+        if not site_ids:
+            return None
+        return random.choice(site_ids)
+
+
+def _open_sites(placement, pinned):
+    """List the IDs of the sites which are empty or hold a cell not pinned."""
+    return [
+        j for j, i in enumerate(placement.site_cells)
+        if i < 0 or placement.cells[i] not in pinned
+    ]
+
+
+# RUDY demand is counted in fixed point, in units of 1 / _DEMAND_SCALE wires.
+_DEMAND_SCALE = 1 << 16
+
+
+class WirelengthCost:
+
+    """Half-perimeter wirelength with a RUDY congestion estimate.
+
+    The wirelength of a net is the half perimeter of the bounding box of
+    its placed source and sinks. Congestion is estimated on the grid of
+    switch blocks using RUDY (rectangular uniform wire density): each net
+    spreads its expected wire evenly over the switch blocks in its bounding
+    box, and demand beyond `tile_capacity` adds to the cost,
+    scaled by `congestion_weight`.
+
+    Demand is counted in fixed point. Each net's rounded density is kept
+    with its bounding box, and the same integer is taken away again when
+    the net is removed, so the totals kept up to date by moves never drift
+    from what `initialize` would compute.
+
+    The costs are kept in the `AnnealerState` so that they are copied along
+    with the placement. When cells are moved, only the nets connected
+    to them are updated.
+
+    """
+
+    def __init__(self, implementation, topology, *, tile_capacity, congestion_weight=1):
+        self.topology = topology
+        self.tile_capacity = tile_capacity
+        self.congestion_weight = congestion_weight
+
+        # The indexes of the nets which each cell or port is part of.
+        self.net_terminals = _net_terminals(implementation)
+        self.node_nets = {}
+        for net_id, terminals in enumerate(self.net_terminals):
+            for node in terminals:
+                node_nets = self.node_nets.setdefault(node, [])
+                if net_id not in node_nets:
+                    node_nets.append(net_id)
+
+        self.columns = topology.width + 1
+        self.rows = topology.height + 1
+
+    def initialize(self, state):
+        """Compute the cost of every net from scratch.
+
+        This must be called before `update` with a state whose placements
+        number their cells and sites the same way.
+
+        """
+        # Terminals are looked up as a (placement, cell index) pair,
+        # where placement 0 is the logic cells and 1 the module ports.
+        placements = (state.logic_cells, state.module_ports)
+        self._terminals = [
+            [self._terminal(placements, node) for node in terminals]
+            for terminals in self.net_terminals
+        ]
+        self._site_positions = (
+            [self.topology.node_position(coords.output)
+             for coords in state.logic_cells.sites],
+            [self.topology.node_position(coords)
+             for coords in state.module_ports.sites],
+        )
+
+        net_count = len(self.net_terminals)
+        state.net_costs = array('d', [0]) * net_count
+        state.net_boxes = [None] * net_count
+        state.total_net_cost = 0
+        state.congestion = [0] * (self.columns * self.rows)
+        state.congestion_overflow = 0
+        state.congestion_cost = 0
+        for net_id in range(net_count):
+            self._add_net(state, net_id)
+        self._update_congestion_cost(state)
+
+    def update(self, state, nodes):
+        """Recompute the cost of the nets connected to the given cells or ports.
+
+        Returns the change in the total cost.
+
+        """
+        start_cost = state.total_net_cost + state.congestion_cost
+        net_ids = set()
+        for node in nodes:
+            net_ids.update(self.node_nets.get(node, ()))
+        for net_id in net_ids:
+            self._remove_net(state, net_id)
+            self._add_net(state, net_id)
+        self._update_congestion_cost(state)
+        return state.total_net_cost + state.congestion_cost - start_cost
+
+    def _terminal(self, placements, node):
+        if isinstance(node, LogicCell):
+            return 0, placements[0].cell_ids[node]
+        elif isinstance(node, ModulePort):
+            return 1, placements[1].cell_ids[node]
+        else:
+            raise NotImplementedError(node)
+
+    def _add_net(self, state, net_id):
+        cell_sites = (state.logic_cells.cell_sites, state.module_ports.cell_sites)
+        site_positions = self._site_positions
+        positions = [
+            site_positions[kind][cell_sites[kind][i]]
+            for kind, i in self._terminals[net_id]
+        ]
+        x0 = min(x for x, _y in positions)
+        x1 = max(x for x, _y in positions)
+        y0 = min(y for _x, y in positions)
+        y1 = max(y for _x, y in positions)
+
+        cost = (x1 - x0) + (y1 - y0)
+        state.net_costs[net_id] = cost
+        state.total_net_cost += cost
+
+        box = self._tiles(x0, y0, x1, y1)
+        column0, row0, column1, row1 = box
+        width = column1 - column0 + 1
+        height = row1 - row0 + 1
+        density = round((width + height) / (width * height) * _DEMAND_SCALE)
+        state.net_boxes[net_id] = box, density
+        self._spread(state, box, density)
+
+    def _remove_net(self, state, net_id):
+        state.total_net_cost -= state.net_costs[net_id]
+        box, density = state.net_boxes[net_id]
+        self._spread(state, box, -density)
+
+    def _tiles(self, x0, y0, x1, y1):
+        # Switch blocks are on integer positions, so these are the ones
+        # surrounding the bounding box.
+        return (
+            max(0, math.floor(x0)),
+            max(0, math.floor(y0)),
+            min(self.columns - 1, math.ceil(x1)),
+            min(self.rows - 1, math.ceil(y1)),
+        )
+
+    def _spread(self, state, box, density):
+        column0, row0, column1, row1 = box
+        congestion = state.congestion
+        capacity = self.tile_capacity * _DEMAND_SCALE
+        overflow_change = 0
+        for row in range(row0, row1 + 1):
+            start = row * self.columns
+            for i in range(start + column0, start + column1 + 1):
+                demand = congestion[i]
+                congestion[i] = demand + density
+                overflow_change += (
+                    max(0, demand + density - capacity) - max(0, demand - capacity))
+        state.congestion_overflow += overflow_change
+
+    def _update_congestion_cost(self, state):
+        state.congestion_cost = (
+            self.congestion_weight * state.congestion_overflow / _DEMAND_SCALE)
+
+
+def analytical_placement(implementation, topology, module_port_coords):
+    """Place logic cells to minimize quadratic wirelength, given placed ports.
+
+    Each net is modelled as a clique of springs between its cells and ports,
+    with the ports fixed where they are placed in `module_port_coords`.
+    Minimizing the total squared spring length gives a sparse linear system
+    for the x and y positions of the cells, which is solved by conjugate
+    gradients. The cells are then legalized by moving each to the free
+    logic cell location nearest to its position.
+
+    Returns a map of every logic cell location to the cell placed there
+    (or None).
+
+    """
+    logic_cells = [node for node in implementation.graph if isinstance(node, LogicCell)]
+    cell_ids = {cell: i for i, cell in enumerate(logic_cells)}
+    port_positions = {
+        port: topology.node_position(coords)
+        for coords, port in module_port_coords.items()
+        if port is not None
+    }
+
+    # Pull every cell very weakly towards the center of the device, so that
+    # cells with no path to a port still have a well defined position.
+    center_x, center_y = topology.width / 2, topology.height / 2
+    diagonal = [_CENTER_WEIGHT] * len(logic_cells)
+    off_diagonal = [{} for _cell in logic_cells]
+    bx = [_CENTER_WEIGHT * center_x] * len(logic_cells)
+    by = [_CENTER_WEIGHT * center_y] * len(logic_cells)
+
+    for terminals in _net_terminals(implementation):
+        terminals = list(dict.fromkeys(terminals))
+        if len(terminals) < 2:
+            continue
+        weight = 1 / (len(terminals) - 1)
+        for a, b in itertools.combinations(terminals, 2):
+            for node, other in ((a, b), (b, a)):
+                if node not in cell_ids:
+                    continue
+                i = cell_ids[node]
+                diagonal[i] += weight
+                if other in cell_ids:
+                    j = cell_ids[other]
+                    off_diagonal[i][j] = off_diagonal[i].get(j, 0) - weight
+                else:
+                    x, y = port_positions[other]
+                    bx[i] += weight * x
+                    by[i] += weight * y
+
+    off_diagonal = [list(row.items()) for row in off_diagonal]
+    xs = _conjugate_gradient(diagonal, off_diagonal, bx, [center_x] * len(logic_cells))
+    ys = _conjugate_gradient(diagonal, off_diagonal, by, [center_y] * len(logic_cells))
+
+    # Cells are centered half a step from their location's coordinates.
+    free_coords = list(topology.iter_logic_cell_coords())
+    placement = dict.fromkeys(free_coords)
+    for i in sorted(range(len(logic_cells)), key=lambda i: (xs[i], ys[i])):
+        x, y = xs[i] - 0.5, ys[i] - 0.5
+        coords = min(
+            free_coords, key=lambda coords: abs(coords.x - x) + abs(coords.y - y))
+        free_coords.remove(coords)
+        placement[coords] = logic_cells[i]
+    return placement
+
+
+# The weight of the spring pulling each cell towards the center of the device.
+_CENTER_WEIGHT = 1e-3
+
+
+def _conjugate_gradient(diagonal, off_diagonal, b, x, *, tolerance=1e-6,
+                        max_iterations=None):
+    # Solves Ax = b for a symmetric positive definite matrix A, given as its
+    # diagonal and the (column, value) pairs of each row's other entries,
+    # preconditioned by the diagonal.
+    def multiply(v):
+        return [
+            d * v_i + sum(value * v[j] for j, value in row)
+            for d, v_i, row in zip(diagonal, v, off_diagonal)
+        ]
+
+    if max_iterations is None:
+        max_iterations = 10 * len(b)
+    r = [b_i - Ax_i for b_i, Ax_i in zip(b, multiply(x))]
+    z = [r_i / d for r_i, d in zip(r, diagonal)]
+    p = list(z)
+    rz = sum(r_i * z_i for r_i, z_i in zip(r, z))
+    threshold = (tolerance * math.sqrt(sum(b_i * b_i for b_i in b))) ** 2
+    for _ in range(max_iterations):
+        if sum(r_i * r_i for r_i in r) <= threshold:
+            break
+        Ap = multiply(p)
+        alpha = rz / sum(p_i * Ap_i for p_i, Ap_i in zip(p, Ap))
+        x = [x_i + alpha * p_i for x_i, p_i in zip(x, p)]
+        r = [r_i - alpha * Ap_i for r_i, Ap_i in zip(r, Ap)]
+        z = [r_i / d for r_i, d in zip(r, diagonal)]
+        rz, previous_rz = sum(r_i * z_i for r_i, z_i in zip(r, z)), rz
+        p = [z_i + rz / previous_rz * p_i for z_i, p_i in zip(z, p)]
+    return x
+
+
+def _net_terminals(implementation):
+    # The cells and ports in each net, with the one driving it first.
+    net_terminals = {}
+    for source, sink, port in implementation.graph.edges.data('port'):
+        if port == 'clock':
+            continue
+        net_terminals.setdefault(source, [source]).append(sink)
+    return list(net_terminals.values())
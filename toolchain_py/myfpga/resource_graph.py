@@ -0,0 +1,215 @@
+"""Compact routing resource graph."""
+
+import mmap
+import struct
+from array import array
+from collections.abc import Mapping, Sequence
+
+
+# The cache file begins with a header holding the magic number and format
+# version, the number of nodes and edges, and the distance cost, padded to
+# 32 bytes. The arrays follow it, each padded to a multiple of 8 bytes,
+# so that every array is aligned for its memory mapped view.
+_FILE_MAGIC = b'MYFPGARR'
+_FILE_VERSION = 2
+_FILE_HEADER = struct.Struct('=8sIII4xd')
+_FILE_ALIGNMENT = 8
+
+
+class RoutingResourceGraph:
+
+    """Routing resource graph with dense integer node IDs.
+
+    Each node is identified by its index into a set of flat arrays.
+    The outgoing edges of a node are stored in compressed sparse row form:
+    the edges of node `i` are at `edge_offsets[i]` up to (but excluding)
+    `edge_offsets[i + 1]` in `edge_ends` and `edge_costs`.
+
+    The node objects are kept only to translate to and from IDs
+    when reporting: `nodes[i]` is the object for ID `i`
+    and `node_ids[node]` is the ID for an object.
+
+    The graph can be saved to a file and memory mapped back in by `load`.
+    The arrays are then views into the file, and each node is stored as
+    an integer key which is only decoded into an object when it is used.
+
+    """
+
+    def __init__(self, nodes, edge_offsets, edge_ends, edge_costs,
+                 base_costs, xs, ys, distance_cost, node_ids=None):
+        self.nodes = nodes
+        if node_ids is None:
+            node_ids = {node: i for i, node in enumerate(nodes)}
+        self.node_ids = node_ids
+        self.edge_offsets = edge_offsets
+        self.edge_ends = edge_ends
+        self.edge_costs = edge_costs
+        self.base_costs = base_costs
+        self.xs = xs
+        self.ys = ys
+        self.distance_cost = distance_cost
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """Convert a graph built by `DeviceTopology.build_network`.
+
+        Edges must have a "cost" attribute and nodes a "pos" attribute.
+
+        """
+        nodes = list(graph)
+        node_ids = {node: i for i, node in enumerate(nodes)}
+
+        edge_offsets = array('i', [0])
+        edge_ends = array('i')
+        edge_costs = array('i')
+        for node in nodes:
+            for _start, end, cost in graph.out_edges(node, data='cost'):
+                edge_ends.append(node_ids[end])
+                edge_costs.append(cost)
+            edge_offsets.append(len(edge_ends))
+
+        positions = [graph.nodes[node]['pos'] for node in nodes]
+        return cls(
+            nodes=nodes,
+            edge_offsets=edge_offsets,
+            edge_ends=edge_ends,
+            edge_costs=edge_costs,
+            base_costs=array('i', [1]) * len(nodes),
+            xs=array('f', (x for x, _y in positions)),
+            ys=array('f', (y for _x, y in positions)),
+            distance_cost=graph.graph['distance_cost'],
+        )
+
+    def save(self, f, encode_node):
+        """Write the graph to a binary file.
+
+        `encode_node` converts each node object to a 64 bit integer key.
+
+        """
+        arrays = [
+            array('q', (encode_node(node) for node in self.nodes)),
+            array('i', self.edge_offsets),
+            array('i', self.edge_ends),
+            array('i', self.edge_costs),
+            array('i', self.base_costs),
+            array('f', self.xs),
+            array('f', self.ys),
+        ]
+        f.write(_FILE_HEADER.pack(
+            _FILE_MAGIC,
+            _FILE_VERSION,
+            len(self),
+            len(self.edge_ends),
+            self.distance_cost,
+        ))
+        for values in arrays:
+            data = values.tobytes()
+            f.write(data)
+            f.write(bytes(-len(data) % _FILE_ALIGNMENT))
+
+    @classmethod
+    def load(cls, f, encode_node, decode_node):
+        """Memory map a graph written by `save`.
+
+        Raises ValueError if the file was not written by this version.
+
+        """
+        buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        if len(buffer) < _FILE_HEADER.size:
+            raise ValueError('Routing resource graph file is truncated')
+        magic, version, node_count, edge_count, distance_cost = (
+            _FILE_HEADER.unpack_from(buffer))
+        if magic != _FILE_MAGIC or version != _FILE_VERSION:
+            raise ValueError('Unsupported routing resource graph file')
+
+        layout = [
+            ('q', node_count),
+            ('i', node_count + 1),
+            ('i', edge_count),
+            ('i', edge_count),
+            ('i', node_count),
+            ('f', node_count),
+            ('f', node_count),
+        ]
+        offset = _FILE_HEADER.size
+        arrays = []
+        for typecode, length in layout:
+            size = array(typecode).itemsize * length
+            if offset + size > len(buffer):
+                raise ValueError('Routing resource graph file is truncated')
+            arrays.append(buffer[offset:offset + size].cast(typecode))
+            offset += size + -size % _FILE_ALIGNMENT
+        node_keys, edge_offsets, edge_ends, edge_costs, base_costs, xs, ys = arrays
+
+        return cls(
+            nodes=_DecodedNodes(node_keys, decode_node),
+            node_ids=_EncodedNodeIds(node_keys, encode_node, decode_node),
+            edge_offsets=edge_offsets,
+            edge_ends=edge_ends,
+            edge_costs=edge_costs,
+            base_costs=base_costs,
+            xs=xs,
+            ys=ys,
+            distance_cost=distance_cost,
+        )
+
+    def __getstate__(self):
+        # Memory mapped arrays cannot be pickled, so send copies instead.
+        state = dict(self.__dict__)
+        for name, value in state.items():
+            if isinstance(value, memoryview):
+                state[name] = array(value.format, value)
+        return state
+
+    def __len__(self):
+        return len(self.edge_offsets) - 1
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def out_edges(self, node_id):
+        """Iterate the (end node ID, cost) pairs of a node's outgoing edges."""
+        start, end = self.edge_offsets[node_id], self.edge_offsets[node_id + 1]
+        return zip(self.edge_ends[start:end], self.edge_costs[start:end])
+
+    def decode(self, node_ids):
+        """Convert a collection of node IDs to a set of node objects."""
+        return {self.nodes[node_id] for node_id in node_ids}
+
+
+class _DecodedNodes(Sequence):
+
+    """Node objects decoded from their integer keys when accessed."""
+
+    def __init__(self, node_keys, decode_node):
+        self.node_keys = node_keys
+        self.decode_node = decode_node
+
+    def __len__(self):
+        return len(self.node_keys)
+
+    def __getitem__(self, node_id):
+        return self.decode_node(self.node_keys[node_id])
+
+    def __getstate__(self):
+        return {'node_keys': array('q', self.node_keys), 'decode_node': self.decode_node}
+
+
+class _EncodedNodeIds(Mapping):
+
+    """Node IDs looked up by encoding node objects into their integer keys."""
+
+    def __init__(self, node_keys, encode_node, decode_node):
+        self.encode_node = encode_node
+        self.decode_node = decode_node
+        self._node_ids = {key: i for i, key in enumerate(node_keys)}
+
+    def __len__(self):
+        return len(self._node_ids)
+
+    def __iter__(self):
+        for key in self._node_ids:
+            yield self.decode_node(key)
+
+    def __getitem__(self, node):
+        return self._node_ids[self.encode_node(node)]
@@ -1,11 +1,45 @@
 
+import os
+import copy
+import json
+import hashlib
+import math
+import time
+import pickle
 import itertools
 from enum import Enum
-from dataclasses import dataclass
+from array import array
+from typing import Optional
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
 
 import networkx as nx
 
 import myfpga.pathfinder as pathfinder
+from myfpga.synthesis import LookUpTable, FlipFlop
+from myfpga.resource_graph import RoutingResourceGraph
+from myfpga.placement import (
+    AnnealingProgress,
+    AnnealingSchedule,
+    Placement,
+    MoveGenerator,
+    WirelengthCost,
+    analytical_placement,
+)
+
+
+# Bump this whenever build_network changes which edges exist or what they
+# cost, so that cached routing resource graphs are rebuilt.
+COST_MODEL_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'myfpga',
+)
+
+# A previous placement is only reused if at least this fraction of the logic
+# cells are still in the design. Otherwise the design is placed from scratch.
+WARM_START_MIN_KEPT = 0.5
 
 
 class CardinalDirection(Enum):
@@ -127,8 +161,81 @@ class DeviceTopology:
                 for output in side.outputs:
                     graph.add_edge(output, io_block_coords, cost=100*output.channel + 1)
 
+        # Record where each node is on the device so that the router can
+        # estimate the remaining cost to a sink. Moving one switch block over
+        # takes at least two edges, each of which costs at least 1 for the
+        # edge itself and 1 for the node it reaches.
+        graph.graph['distance_cost'] = 4
+        for node in graph:
+            graph.nodes[node]['pos'] = self.node_position(node)
+
+        return graph
+
+    def build_resource_graph(self, cache_dir=None):
+        """Build the compact routing resource graph used by the router.
+
+        If a cache directory is given, the graph is memory mapped from it
+        when the same device has been built before, and saved to it otherwise.
+        The cache is skipped if it cannot be written.
+
+        """
+        if cache_dir is None:
+            return RoutingResourceGraph.from_networkx(self.build_network())
+
+        filename = (
+            f'rrgraph_{self.width}x{self.height}'
+            f'_c{SWITCH_BLOCK_CHANNELS}_v{COST_MODEL_VERSION}.bin'
+        )
+        path = os.path.join(cache_dir, filename)
+        try:
+            with open(path, 'rb') as f:
+                return RoutingResourceGraph.load(f, encode_node, decode_node)
+        except (OSError, ValueError):
+            pass
+
+        graph = RoutingResourceGraph.from_networkx(self.build_network())
+        # Write to a temporary file first so that another run never maps
+        # a partially written graph.
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                graph.save(f, encode_node)
+            os.replace(temp_path, path)
+        except OSError as exc:
+            print(f'Not caching the routing resource graph: {exc}')
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
         return graph
 
+    def node_position(self, node):
+        """Find the position of a routing node on the device.
+
+        Positions are measured in switch blocks, which sit on the integer
+        grid points. Logic cells are centered between their four corner
+        switch blocks, and I/O blocks are half a step outside the switch
+        block that they are attached to.
+
+        """
+        if isinstance(node, (SwitchBlockSideInput, SwitchBlockSideOutput)):
+            coords = node.side.coords
+            return coords.x, coords.y
+        elif isinstance(node, SwitchBlockCorner):
+            return node.coords.x, node.coords.y
+        elif isinstance(node, (LogicCellInput, LogicCellOutput)):
+            return node.coords.x + 0.5, node.coords.y + 0.5
+        elif isinstance(node, IoBlockCoordinates):
+            return {
+                CardinalDirection.north: (node.index, -0.5),
+                CardinalDirection.south: (node.index, self.height + 0.5),
+                CardinalDirection.west: (-0.5, node.index),
+                CardinalDirection.east: (self.width + 0.5, node.index),
+            }[node.direction]
+        else:
+            raise NotImplementedError(node)
+
     def adjacent_switch_blocks(self, coords):
         """Find switch blocks adjacent to a given switch block's coordinates.
 
@@ -341,48 +448,57 @@ class IoBlockCoordinates:
 #     coords: IoBlockCoordinates
 
 
-import statistics
-from simanneal import Annealer
+# Routing nodes are stored in the routing resource graph cache as 64 bit keys,
+# packing the kind of node with up to four small fields.
+_NODE_KINDS = [
+    SwitchBlockSideInput,
+    SwitchBlockSideOutput,
+    SwitchBlockCorner,
+    LogicCellInput,
+    LogicCellOutput,
+    IoBlockCoordinates,
+]
+_NODE_KIND_INDICES = {kind: i for i, kind in enumerate(_NODE_KINDS)}
+
+
+def encode_node(node):
+    """Pack a routing node into an integer key."""
+    if isinstance(node, (SwitchBlockSideInput, SwitchBlockSideOutput)):
+        coords = node.side.coords
+        fields = coords.x, coords.y, node.side.direction.value, node.channel
+    elif isinstance(node, SwitchBlockCorner):
+        fields = node.coords.x, node.coords.y, node.direction.value, 0
+    elif isinstance(node, LogicCellInput):
+        fields = node.coords.x, node.coords.y, node.port, 0
+    elif isinstance(node, LogicCellOutput):
+        fields = node.coords.x, node.coords.y, 0, 0
+    elif isinstance(node, IoBlockCoordinates):
+        fields = node.index, 0, node.direction.value, 0
+    else:
+        raise NotImplementedError(node)
+    a, b, c, d = fields
+    return _NODE_KIND_INDICES[type(node)] << 48 | a << 32 | b << 16 | c << 8 | d
+
+
+def decode_node(key):
+    """Unpack a routing node from an integer key made by `encode_node`."""
+    kind = _NODE_KINDS[key >> 48]
+    a, b, c, d = (key >> 32) & 0xffff, (key >> 16) & 0xffff, (key >> 8) & 0xff, key & 0xff
+    if kind in (SwitchBlockSideInput, SwitchBlockSideOutput):
+        side = SwitchBlockCoordinates(a, b).side(CardinalDirection(c))
+        return kind(side=side, channel=d)
+    elif kind is SwitchBlockCorner:
+        return SwitchBlockCoordinates(a, b).corner(IntercardinalDirection(c))
+    elif kind is LogicCellInput:
+        return LogicCellCoordinates(a, b).input(c)
+    elif kind is LogicCellOutput:
+        return LogicCellCoordinates(a, b).output
+    else:
+        return IoBlockCoordinates(CardinalDirection(c), a)
 
 
-
-
-
-
-
-# def route_design(implementation, topology):
-#     all_routes = []
-#     for seed in range(10):
-#         routes = _route_design(implementation, topology, seed)
-
-#         # We compute a score for the routing based on the median number of
-#         # nodes in each net of the netlist (lower is better).
-#         score = statistics.median(len(net) for net in routes.values())
-#         print(f'Seed {seed} earns score {score}')
-
-#         all_routes.append((score, seed, routes))
-
-#     all_routes.sort()
-
-#     worst_score, worst_seed, worst_routes = all_routes[-1]
-#     print(f'Worst Route: seed {worst_seed} earned {worst_score}')
-#     for source, route in worst_routes.items():
-#         print(source)
-#         print('-----------------------------------------------------')
-#         for x in route:
-#             print(x)
-#         print('-----------------------------------------------------\n')
-
-#     print('\n=======================================================\n')
-
-#     best_score, best_seed, best_routes = all_routes[0]
-#     print(f'Best Route: seed {best_seed} earned {best_score}')
-#     for source, route in best_routes.items():
-#         print(source)
-#         print('-----------------------------------------------------')
-#         for x in route:
-#             print(x)
-#         print('-----------------------------------------------------\n')
+import statistics
+from simanneal import Annealer
 
 import itertools
 import random
@@ -393,17 +509,48 @@ from myfpga.implementation import LogicCell, ModulePort
 
 @dataclass
 class AnnealerState:
-    logic_cell_coords: None
-    module_port_coords: None
+    # Where each logic cell and module port is placed.
+    logic_cells: Placement
+    module_ports: Placement
+    # The cost of each net and the total of all of them.
+    # The placement cost model keeps these up to date.
+    net_costs: object = None
+    total_net_cost: float = 0
+    # The switch blocks covered by each net's bounding box, the estimated
+    # demand for tracks through each switch block, the total demand beyond
+    # their capacity and its cost. Only used by `WirelengthCost`.
+    net_boxes: list = None
+    congestion: object = None
+    congestion_overflow: int = 0
+    congestion_cost: float = 0
     # TODO: constraints
 
+    def copy(self):
+        # Everything is either immutable or a flat container of immutable
+        # values, so shallow copies are enough.
+        return AnnealerState(
+            logic_cells=self.logic_cells.copy(),
+            module_ports=self.module_ports.copy(),
+            net_costs=copy.copy(self.net_costs),
+            total_net_cost=self.total_net_cost,
+            net_boxes=copy.copy(self.net_boxes),
+            congestion=copy.copy(self.congestion),
+            congestion_overflow=self.congestion_overflow,
+            congestion_cost=self.congestion_cost,
+        )
+
 
 class RoutingAnnealer(Annealer):
 
-    def __init__(self, router, state):
-        # TODO: Use different copying strategy?
+    # Copy states with AnnealerState.copy rather than deepcopy.
+    copy_strategy = 'method'
+
+    def __init__(self, router, state, pinned=()):
         self.router = router
-        self._current_routes = router._route(state)
+        self.placement_cost = router.placement_cost
+        self.placement_cost.initialize(state)
+        self.moves = MoveGenerator(router.topology, state, pinned=pinned)
+        self._last_move = None
         super().__init__(state)
 
     def set_user_exit(self, signum, frame):
@@ -413,198 +560,853 @@ class RoutingAnnealer(Annealer):
         raise KeyboardInterrupt
         # super().set_user_exit(signum, frame)
 
-    def update(self, *args, **kwargs):
-        # Overridden to avoid printing progress to stderr.
-        super().update(*args, **kwargs)
-        pass
-
     def move(self):
+        move = self._last_move = self.moves.propose(self.state)
+        if move is None:
+            return 0
+        placement, site1, site2 = move
+        placement.swap(site1, site2)
+
+        # Only the nets connected to the two cells or ports can have changed.
+        return self.placement_cost.update(
+            self.state, [placement.cell(site1), placement.cell(site2)])
+
+    def undo_move(self):
+        """Swap back the sites changed by the last move."""
+        if self._last_move is not None:
+            placement, site1, site2 = self._last_move
+            placement.swap(site1, site2)
+            self.placement_cost.update(
+                self.state, [placement.cell(site1), placement.cell(site2)])
 
-        # Swap two logic cell locations
-        start_energy = self.energy()
-        # print(f'moving: {start_energy}')
+    def energy(self):
+        return self.state.total_net_cost + self.state.congestion_cost
 
-        d = self.state.logic_cell_coords
-        location1, location2 = random.sample(list(d), 2)
-        d[location1], d[location2] = d[location2], d[location1]
+    def anneal_adaptive(self, schedule, *, refine=False,  # noqa: C901
+                        progress=None, on_temperature=None):
+        """Anneal following an `AnnealingSchedule`.
 
-        # TODO: Sometimes swap IO blocks instead
+        If `refine` is true, the state is already a good placement, and the
+        annealer starts at a lower temperature so as not to scramble it.
+        Rejected moves are undone rather than restoring a copy of the
+        state, so the state is only copied when a new best is found.
+        Returns the best state and its energy.
 
-        self._current_routes = self.router._route(self.state)
-        return self.energy() - start_energy
+        After each temperature, `on_temperature` is called with an
+        `AnnealingProgress`, if given. Passing that back as `progress`,
+        with the annealer's state restored to its current placement,
+        carries on annealing from where it was. A `ValueError` is raised if
+        the restored placement does not have the saved energy.
 
+        """
+        cell_count = self.moves.cell_count
+        net_count = max(1, len(self.state.net_costs))
+        moves_per_temperature = max(
+            1, round(schedule.moves_per_temperature * cell_count ** (4 / 3)))
+
+        energy = self.energy()
+        if progress is None:
+            start_time = time.perf_counter()
+            initial_energy = energy
+            if refine:
+                temperature_factor = schedule.refine_temperature_factor
+            else:
+                temperature_factor = schedule.initial_temperature_factor
+            temperature = temperature_factor * self._move_deviation(cell_count)
+            temperatures = 0
+            stalled_temperatures = 0
+            best_state, best_energy = self.copy_state(self.state), energy
+        else:
+            if energy != progress.energy:
+                raise ValueError(
+                    f'Restored placement has energy {energy}, '
+                    f'but {progress.energy} was saved')
+            start_time = time.perf_counter() - progress.elapsed
+            initial_energy = progress.initial_energy
+            temperature = progress.temperature
+            temperatures = progress.temperatures
+            stalled_temperatures = progress.stalled_temperatures
+            self.moves.range_limit = progress.range_limit
+            random.setstate(progress.random_state)
+            best_state = self.restore_state(
+                progress.best_logic_cells, progress.best_module_ports)
+            best_energy = best_state.total_net_cost + best_state.congestion_cost
+
+        while temperature > 0:
+            accepted = 0
+            improved = False
+            for _ in range(moves_per_temperature):
+                delta = self.move()
+                if delta > 0 and random.random() >= math.exp(-delta / temperature):
+                    self.undo_move()
+                    continue
+                accepted += 1
+                energy = self.energy()
+                if energy < best_energy:
+                    best_state, best_energy = self.copy_state(self.state), energy
+                    improved = True
+
+            temperatures += 1
+            acceptance = accepted / moves_per_temperature
+            self.moves.adapt(acceptance)
+            if improved:
+                stalled_temperatures = 0
+            elif acceptance < 0.15:
+                # Only count stalls once the placement has started to freeze,
+                # since the best cost rarely improves while it is still hot.
+                stalled_temperatures += 1
+            if temperature < schedule.exit_factor * energy / net_count:
+                break
+            if _schedule_limit_reached(
+                schedule,
+                time.perf_counter() - start_time,
+                best_energy,
+                stalled_temperatures,
+            ):
+                break
+            temperature *= schedule.cooling_factor(acceptance)
+
+            if on_temperature is not None:
+                on_temperature(AnnealingProgress(
+                    temperature=temperature,
+                    temperatures=temperatures,
+                    stalled_temperatures=stalled_temperatures,
+                    range_limit=self.moves.range_limit,
+                    elapsed=time.perf_counter() - start_time,
+                    random_state=random.getstate(),
+                    initial_energy=initial_energy,
+                    energy=self.energy(),
+                    logic_cells=array('i', self.state.logic_cells.site_cells),
+                    module_ports=array('i', self.state.module_ports.site_cells),
+                    best_logic_cells=array('i', best_state.logic_cells.site_cells),
+                    best_module_ports=array('i', best_state.module_ports.site_cells),
+                ))
+
+        self.state = best_state
+        return best_state, best_energy
+
+    def restore_state(self, logic_cell_site_cells, module_port_site_cells):
+        """Build a state like the current one from saved `site_cells` arrays."""
+        logic_cells, module_ports = self.state.logic_cells, self.state.module_ports
+        state = AnnealerState(
+            logic_cells=Placement.from_site_cells(
+                logic_cells.cells, logic_cells.sites, logic_cell_site_cells),
+            module_ports=Placement.from_site_cells(
+                module_ports.cells, module_ports.sites, module_port_site_cells),
+        )
+        self.placement_cost.initialize(state)
+        return state
+
+    def _move_deviation(self, move_count):
+        # Judge how hot to start by how much single moves change the energy.
+        # Each trial move is undone, so that the starting placement is kept.
+        deltas = []
+        for _ in range(move_count):
+            deltas.append(self.move())
+            self.undo_move()
+        return statistics.pstdev(deltas)
+
+
+def _schedule_limit_reached(schedule, elapsed, best_energy, stalled_temperatures):
+    return (
+        (schedule.time_limit is not None and elapsed >= schedule.time_limit)
+        or (schedule.target_cost is not None and best_energy <= schedule.target_cost)
+        or (schedule.stall_temperatures is not None
+            and stalled_temperatures >= schedule.stall_temperatures)
+    )
 
-    def energy(self):
-        # TODO
-        return score_routes(self._current_routes)
 
+@dataclass
+class PlacementChain:
 
-def score_routes(routes):
-    return statistics.median(len(net) for net in routes.values())
+    """Statistics for one annealing chain of a multi-start placement."""
 
+    seed: int
+    initial_energy: float
+    energy: float
+    wirelength: float
+    congestion: float
+    elapsed: float
 
-class Router:
 
-    def __init__(self, implementation, topology):
-        self.implementation = implementation
-        self.topology = topology
-        self.network = self.topology.build_network()
+@dataclass
+class Checkpoint:
+
+    """Progress of a `Router` run, saved so that it can be resumed.
+
+    `design` identifies the implementation, device and options which the
+    checkpoint is for. Placements are saved as pairs of `site_cells` arrays
+    for the logic cells and the module ports.
+
+    """
+
+    design: tuple
+    # Each chain which has finished annealing, with its best placement.
+    chains: list = field(default_factory=list)
+    # The chain being annealed, if any.
+    annealing_seed: Optional[int] = None
+    annealing: Optional[AnnealingProgress] = None
+    # Once placement has finished, the placement and the negotiation so far.
+    placement: Optional[tuple] = None
+    negotiation: Optional[pathfinder.NegotiationState] = None
+
+    def save(self, path):
+        # Write to a temporary file first so that a run stopped while saving
+        # leaves the previous checkpoint intact.
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if not isinstance(checkpoint, cls):
+            raise ValueError(f'{path} is not a checkpoint')
+        return checkpoint
+
+
+@dataclass
+class RoutedDesign:
+
+    """A placed and routed design.
 
-    def solve(self):
-        logic_cells = [node for node in self.implementation.graph if isinstance(node, LogicCell)]
-        all_logic_cell_coords = list(self.topology.iter_logic_cell_coords())
-        random.shuffle(all_logic_cell_coords)
+    Placements map device coordinates to the logic cell or module port
+    placed there (or None). Nets map each source routing node to its sink
+    routing nodes, and routes map each source to all of the routing nodes
+    in its net.
+
+    """
+
+    logic_cell_coords: dict
+    module_port_coords: dict
+    nets: dict
+    routes: dict
+
+    def save(self, f):
+        json.dump({
+            'logic_cells': [
+                {'x': coords.x, 'y': coords.y, **_logic_cell_to_json(logic_cell)}
+                for coords, logic_cell in self.logic_cell_coords.items()
+                if logic_cell is not None
+            ],
+            'module_ports': [
+                {
+                    'direction': coords.direction.name,
+                    'index': coords.index,
+                    'name': module_port.name,
+                    'bit_index': module_port.bit_index,
+                    'is_input': module_port.is_input,
+                }
+                for coords, module_port in self.module_port_coords.items()
+                if module_port is not None
+            ],
+            'nets': [
+                {
+                    'source': encode_node(source),
+                    'sinks': [encode_node(node) for node in sinks],
+                    'route': [encode_node(node) for node in self.routes[source]],
+                }
+                for source, sinks in self.nets.items()
+            ],
+        }, f)
+
+    @classmethod
+    def load(cls, f):
+        data = json.load(f)
         logic_cell_coords = {
-            coords: logic_cell for coords, logic_cell
-            in itertools.zip_longest(all_logic_cell_coords, logic_cells)
+            LogicCellCoordinates(item['x'], item['y']): _logic_cell_from_json(item)
+            for item in data['logic_cells']
         }
-
-        module_ports = [node for node in self.implementation.graph if isinstance(node, ModulePort)]
-        all_io_block_coords = list(self.topology.iter_io_block_coords())
-        random.shuffle(all_io_block_coords)
         module_port_coords = {
-            coords: module_port for coords, module_port
-            in itertools.zip_longest(all_io_block_coords, module_ports)
+            IoBlockCoordinates(CardinalDirection[item['direction']], item['index']):
+                ModulePort(
+                    name=item['name'],
+                    bit_index=item['bit_index'],
+                    is_input=item['is_input'],
+                )
+            for item in data['module_ports']
         }
-
-        init_state = AnnealerState(
+        nets = {
+            decode_node(item['source']): {decode_node(key) for key in item['sinks']}
+            for item in data['nets']
+        }
+        routes = {
+            decode_node(item['source']): {decode_node(key) for key in item['route']}
+            for item in data['nets']
+        }
+        return cls(
             logic_cell_coords=logic_cell_coords,
             module_port_coords=module_port_coords,
+            nets=nets,
+            routes=routes,
         )
 
-        annealer = RoutingAnnealer(self, init_state)
-        print('Setting schedule')
-        annealer.set_schedule(annealer.auto(minutes=1, steps=100))  # ???
-        print('Annealing')
-        state, _energy = annealer.anneal()
-        print('final energy:', _energy)
-        return self._route(state)  # TODO: Just return last "_current_routes" from Annealer directly?
 
-    def _route(self, state):
-        # TODO: This seems weird
-        logic_cell_coords = {v: k for k, v in state.logic_cell_coords.items()}
-        module_port_coords = {v: k for k, v in state.module_port_coords.items()}
+def _logic_cell_to_json(logic_cell):
+    lut, ff = logic_cell.lut, logic_cell.ff
+    return {
+        'lut': {'name': lut.name, 'config': lut.config},
+        'ff': None if ff is None else {
+            'name': ff.name,
+            'rising_edge_trigger': ff.rising_edge_trigger,
+        },
+    }
 
-        nets = {}
-        for source, sink, port in self.implementation.graph.edges.data('port'):
-            if port == 'clock':
-                continue
 
-            if isinstance(source, LogicCell):
-                source = logic_cell_coords[source].output
-            elif isinstance(source, ModulePort):
-                source = module_port_coords[source]
-            else:
-                raise NotImplementedError(source)
+def _logic_cell_from_json(data):
+    ff = data['ff']
+    return LogicCell(
+        lut=LookUpTable(**data['lut']),
+        ff=None if ff is None else FlipFlop(**ff),
+    )
 
-            if isinstance(sink, LogicCell):
-                assert isinstance(port, int)
-                sink = logic_cell_coords[sink].input(port)
-            elif isinstance(sink, ModulePort):
-                sink = module_port_coords[sink]
-            else:
-                raise NotImplementedError(sink)
 
-            nets.setdefault(source, set()).add(sink)
+def _net_tables(implementation):
+    """Find the sinks of each net and the nets which each node is part of.
 
-        return pathfinder.route(self.network, nets)
+    Nets are keyed by the logic cell or module port driving them. Clock
+    connections are left out, since the clock is not routed.
 
+    """
+    net_sinks = {}
+    node_nets = {}
+    for source, sink, port in implementation.graph.edges.data('port'):
+        if port == 'clock':
+            continue
+        net_sinks.setdefault(source, []).append((sink, port))
+        node_nets.setdefault(source, set()).add(source)
+        node_nets.setdefault(sink, set()).add(source)
+    return net_sinks, node_nets
 
 
+def _placed_net(network, net_sinks, state, driver):
+    """Find the routing node IDs of a net's source and sinks as placed."""
+    node_ids = network.node_ids
 
+    if isinstance(driver, LogicCell):
+        source = state.logic_cells.site(driver).output
+    elif isinstance(driver, ModulePort):
+        source = state.module_ports.site(driver)
+    else:
+        raise NotImplementedError(driver)
 
+    sinks = set()
+    for sink, port in net_sinks[driver]:
+        if isinstance(sink, LogicCell):
+            assert isinstance(port, int)
+            sink = state.logic_cells.site(sink).input(port)
+        elif isinstance(sink, ModulePort):
+            sink = state.module_ports.site(sink)
+        else:
+            raise NotImplementedError(sink)
+        sinks.add(node_ids[sink])
 
-def route_design(implementation, topology):
-    try:
-        router = Router(implementation, topology)
-        routes = router.solve()
-    except KeyboardInterrupt:
-        print('Aborted')
-        return None
+    return node_ids[source], sinks
 
-    import pdb; pdb.set_trace();  # TODO: remove me
-    pass
 
+class RoutedNetCost:
 
-    random.seed(1234)
+    """Placement cost model which routes each net alone on the device.
 
+    This is more accurate than `WirelengthCost`, but much slower.
+    `network` is the routing resource graph of the device, as built by
+    `DeviceTopology.build_resource_graph`.
 
-    logic_cells = [node for node in implementation.graph if isinstance(node, LogicCell)]
-    all_logic_cell_coords = list(topology.iter_logic_cell_coords())
-    random.shuffle(all_logic_cell_coords)
-    logic_cell_coords = {
-        coords: logic_cell for coords, logic_cell
-        in itertools.zip_longest(all_logic_cell_coords, logic_cells)
-    }
+    """
 
-    module_ports = [node for node in implementation.graph if isinstance(node, ModulePort)]
-    all_io_block_coords = list(topology.iter_io_block_coords())
-    random.shuffle(all_io_block_coords)
-    module_port_coords = {
-        coords: module_port for coords, module_port
-        in itertools.zip_longest(all_io_block_coords, module_ports)
-    }
+    def __init__(self, implementation, network):
+        self.network = network
+        self.net_sinks, self.node_nets = _net_tables(implementation)
 
-    # TODO
-    logic_cell_coords2 = {v: k for k, v in logic_cell_coords.items()}
-    module_port_coords2 = {v: k for k, v in module_port_coords.items()}
+    def initialize(self, state):
+        """Compute the cost of every net from scratch."""
+        state.net_costs = {
+            driver: self._net_cost(state, driver)
+            for driver in self.net_sinks
+        }
+        state.total_net_cost = sum(state.net_costs.values())
 
+    def update(self, state, nodes):
+        """Recompute the cost of the nets connected to the given cells or ports.
 
+        Returns the change in the total cost.
 
-    network = topology.build_network()
+        """
+        drivers = set()
+        for node in nodes:
+            drivers.update(self.node_nets.get(node, ()))
+
+        delta = 0
+        for driver in drivers:
+            cost = self._net_cost(state, driver)
+            delta += cost - state.net_costs[driver]
+            state.net_costs[driver] = cost
+        state.total_net_cost += delta
+        return delta
+
+    def _net_cost(self, state, driver):
+        # Each net is routed as if it were alone on the device, which is
+        # much cheaper than negotiating every net for every annealing move.
+        source, sinks = _placed_net(self.network, self.net_sinks, state, driver)
+        route = pathfinder.route_net(
+            self.network, source, sinks, astar_factor=1, bbox_margin=3)
+        return len(route)
 
-    # route_graph = nx.DiGraph()
-    nets = {}
 
-    for source, sink, port in implementation.graph.edges.data('port'):
-        if port == 'clock':
-            continue
+class Router:
+
+    """Place and route an implementation on a device.
 
-        if isinstance(source, LogicCell):
-            source = logic_cell_coords2[source].output
-        elif isinstance(source, ModulePort):
-            source = module_port_coords2[source]
+    The initial placement is either 'analytical', minimizing quadratic
+    wirelength given randomly placed module ports, or 'random'. It is then
+    annealed against `placement_cost`, which by default estimates
+    wirelength and congestion without routing. The design is only routed
+    once, after placement.
+
+    One annealing chain is run for each of the random `seeds`, and the
+    best placement is kept. With more than one worker, the chains are run
+    in parallel, as are the nets while routing. The result only depends
+    on the seeds, not on the number of workers.
+
+    If a `checkpoint_path` is given, a `Checkpoint` is saved there at most
+    every `checkpoint_interval` seconds while annealing and routing, and
+    whenever an annealing chain finishes. The chains are then run one at
+    a time in this process. Passing a loaded checkpoint as `resume` carries
+    on from where it was saved.
+
+    """
+
+    def __init__(self, implementation, topology, *, workers=1, schedule=None,
+                 cache_dir=DEFAULT_CACHE_DIR, placement_cost=None, seeds=(0,),
+                 placement_schedule=None, initial_placement='analytical',
+                 checkpoint_path=None, checkpoint_interval=60, resume=None):
+        if initial_placement not in ('analytical', 'random'):
+            raise ValueError(f'Unknown initial placement {initial_placement!r}')
+        self.implementation = implementation
+        self.topology = topology
+        self.workers = workers
+        self.seeds = tuple(seeds)
+        self.initial_placement = initial_placement
+        if placement_schedule is None:
+            placement_schedule = AnnealingSchedule()
+        self.placement_schedule = placement_schedule
+        self.schedule = schedule
+        self.network = self.topology.build_resource_graph(cache_dir)
+
+        # The sinks of each net, keyed by the logic cell or module port driving it.
+        self._net_sinks, _node_nets = _net_tables(implementation)
+
+        if placement_cost is None:
+            # Each switch block carries its channels both across and along.
+            placement_cost = WirelengthCost(
+                implementation, topology, tile_capacity=2 * SWITCH_BLOCK_CHANNELS)
+        self.placement_cost = placement_cost
+
+        # Cells and sites are always numbered in the same order, so that
+        # placements saved in checkpoints can be restored.
+        graph = self.implementation.graph
+        self._logic_cells = [node for node in graph if isinstance(node, LogicCell)]
+        self._module_ports = [node for node in graph if isinstance(node, ModulePort)]
+        self._logic_cell_sites = list(self.topology.iter_logic_cell_coords())
+        self._io_block_sites = list(self.topology.iter_io_block_coords())
+
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        design = (
+            _netlist_digest(implementation),
+            self.topology.width,
+            self.topology.height,
+            SWITCH_BLOCK_CHANNELS,
+            COST_MODEL_VERSION,
+            self.seeds,
+            self.initial_placement,
+        )
+        if resume is None:
+            resume = Checkpoint(design)
+        elif resume.design != design:
+            raise ValueError('Checkpoint is for a different design or options')
+        self._checkpoint = resume
+        self._last_checkpoint_time = time.monotonic()
+
+    def solve(self, previous=None):
+        """Place and route the implementation.
+
+        If a previous `RoutedDesign` of an earlier version of the design is
+        given, cells and module ports which are still in the implementation
+        start from their locations, and the placement is refined by a low
+        temperature anneal rather than annealed from scratch. Nets which are
+        unchanged keep their routes. If too few cells are still in the
+        implementation, it is placed from scratch instead.
+
+        """
+        checkpoint = self._checkpoint
+        if checkpoint.placement is not None:
+            state = self._restore_state(*checkpoint.placement)
         else:
-            raise NotImplementedError(source)
+            state = None if previous is None else self._warm_start(previous)
+            if state is None:
+                state, chains = self.place()
+                for chain in chains:
+                    print(chain)
+
+        if self.checkpoint_path is not None and checkpoint.placement is None:
+            checkpoint.placement = (
+                state.logic_cells.site_cells,
+                state.module_ports.site_cells,
+            )
+            checkpoint.annealing_seed = checkpoint.annealing = None
+            self._save_checkpoint(force=True)
+
+        if checkpoint.negotiation is not None:
+            print('Resuming routing')
+        else:
+            print('Routing')
+        nets = self._build_nets(state)
+        routes = self._route_nets(
+            nets,
+            workers=self.workers,
+            on_iteration=print,
+            previous=previous,
+            on_checkpoint=(
+                None if self.checkpoint_path is None else self._checkpoint_negotiation),
+            resume=checkpoint.negotiation,
+        )
+        nodes, decode = self.network.nodes, self.network.decode
+        return RoutedDesign(
+            logic_cell_coords=state.logic_cells.to_dict(),
+            module_port_coords=state.module_ports.to_dict(),
+            nets={nodes[source]: decode(sinks) for source, sinks in nets.items()},
+            routes={nodes[source]: decode(route) for source, route in routes.items()},
+        )
 
-        if isinstance(sink, LogicCell):
-            assert isinstance(port, int)
-            sink = logic_cell_coords2[sink].input(port)
-        elif isinstance(sink, ModulePort):
-            sink = module_port_coords2[sink]
+    def place(self):
+        """Anneal a placement from each seed and keep the best one.
+
+        Returns the state of the best placement and a `PlacementChain`
+        for each seed, in the same order as the seeds.
+
+        """
+        if self.workers > 1 and len(self.seeds) > 1 and self.checkpoint_path is None:
+            with ProcessPoolExecutor(
+                max_workers=min(self.workers, len(self.seeds)),
+                initializer=_init_worker,
+                initargs=(self,),
+            ) as executor:
+                results = list(executor.map(_anneal_chain, self.seeds))
         else:
-            raise NotImplementedError(sink)
+            finished_chains = {
+                chain.seed: (chain, logic_cells, module_ports)
+                for chain, logic_cells, module_ports in self._checkpoint.chains
+            }
+            results = []
+            for seed in self.seeds:
+                if seed in finished_chains:
+                    chain, logic_cells, module_ports = finished_chains[seed]
+                    state = self._restore_state(logic_cells, module_ports)
+                    results.append((state, chain))
+                    continue
+                state, chain = self._anneal(seed)
+                results.append((state, chain))
+                if self.checkpoint_path is not None:
+                    self._checkpoint.chains.append((
+                        chain,
+                        state.logic_cells.site_cells,
+                        state.module_ports.site_cells,
+                    ))
+                    self._checkpoint.annealing_seed = self._checkpoint.annealing = None
+                    self._save_checkpoint(force=True)
+
+        chains = [chain for _state, chain in results]
+        # Ties go to the earliest seed.
+        best_state, _best_chain = min(results, key=lambda result: result[1].energy)
+        return best_state, chains
+
+    def _anneal(self, seed):
+        checkpoint = self._checkpoint
+        if checkpoint.annealing is not None and checkpoint.annealing_seed == seed:
+            progress = checkpoint.annealing
+            print(f'Resuming annealing (seed {seed})')
+            start_time = time.perf_counter() - progress.elapsed
+            init_state = self._restore_state(progress.logic_cells, progress.module_ports)
+            annealer = RoutingAnnealer(self, init_state)
+            initial_energy = progress.initial_energy
+        else:
+            progress = None
+            start_time = time.perf_counter()
+            print(f'Annealing (seed {seed})')
+            annealer = RoutingAnnealer(self, self._initial_state(seed))
+            initial_energy = annealer.energy()
+
+        if self.checkpoint_path is None:
+            on_temperature = None
+        else:
+            def on_temperature(progress):
+                checkpoint.annealing_seed = seed
+                checkpoint.annealing = progress
+                self._save_checkpoint()
+
+        state, energy = annealer.anneal_adaptive(
+            self.placement_schedule,
+            refine=self.initial_placement == 'analytical',
+            progress=progress,
+            on_temperature=on_temperature,
+        )
+        return state, PlacementChain(
+            seed=seed,
+            initial_energy=initial_energy,
+            energy=energy,
+            wirelength=state.total_net_cost,
+            congestion=state.congestion_cost,
+            elapsed=time.perf_counter() - start_time,
+        )
 
-        # route_graph.add_edge(source, sink)
-        # print(source, f'--{port}-->', sink)
+    def _initial_state(self, seed):
+        # simanneal draws from the global random generator,
+        # so that is what has to be seeded.
+        random.seed(seed)
 
-        nets.setdefault(source, set()).add(sink)
+        all_io_block_coords = list(self._io_block_sites)
+        random.shuffle(all_io_block_coords)
+        module_port_coords = {
+            coords: module_port for coords, module_port
+            in itertools.zip_longest(all_io_block_coords, self._module_ports)
+        }
 
-    state = AnnealerState(
-        logic_cell_coords=logic_cell_coords,
-        module_port_coords=module_port_coords,
-    )
+        if self.initial_placement == 'analytical':
+            logic_cell_coords = analytical_placement(
+                self.implementation, self.topology, module_port_coords)
+        else:
+            all_logic_cell_coords = list(self._logic_cell_sites)
+            random.shuffle(all_logic_cell_coords)
+            logic_cell_coords = {
+                coords: logic_cell for coords, logic_cell
+                in itertools.zip_longest(all_logic_cell_coords, self._logic_cells)
+            }
+
+        return self._make_state(logic_cell_coords, module_port_coords)
+
+    def _make_state(self, logic_cell_coords, module_port_coords):
+        return AnnealerState(
+            logic_cells=Placement.from_dict(
+                {
+                    coords: logic_cell_coords.get(coords)
+                    for coords in self._logic_cell_sites
+                },
+                self._logic_cells,
+            ),
+            module_ports=Placement.from_dict(
+                {
+                    coords: module_port_coords.get(coords)
+                    for coords in self._io_block_sites
+                },
+                self._module_ports,
+            ),
+        )
+
+    def _restore_state(self, logic_cell_site_cells, module_port_site_cells):
+        return AnnealerState(
+            logic_cells=Placement.from_site_cells(
+                self._logic_cells, self._logic_cell_sites, logic_cell_site_cells),
+            module_ports=Placement.from_site_cells(
+                self._module_ports, self._io_block_sites, module_port_site_cells),
+        )
+
+    def _checkpoint_negotiation(self, negotiation):
+        # The negotiation state refers to the router's own data, which
+        # changes after this returns, so it is only kept while saving.
+        self._checkpoint.negotiation = negotiation
+        self._save_checkpoint()
+        self._checkpoint.negotiation = None
+
+    def _save_checkpoint(self, *, force=False):
+        now = time.monotonic()
+        if force or now - self._last_checkpoint_time >= self.checkpoint_interval:
+            self._checkpoint.save(self.checkpoint_path)
+            self._last_checkpoint_time = now
+
+    def _warm_start(self, previous):
+        """Place the implementation starting from a previous placement.
+
+        Cells and module ports which are in both keep their locations.
+        Each new one is put in the free location nearest to the cells and
+        ports that it connects to which have already been placed, and then
+        the new ones are refined by annealing from a low temperature, with
+        the kept ones pinned so that their nets can keep their routes.
+
+        Returns None if fewer than `WARM_START_MIN_KEPT` of the logic cells
+        were in the previous placement.
 
+        """
+        logic_cell_coords, kept_logic_cells = self._keep_placement(
+            previous.logic_cell_coords,
+            self._logic_cell_sites,
+            self._logic_cells,
+        )
+        if len(kept_logic_cells) < WARM_START_MIN_KEPT * len(self._logic_cells):
+            print(
+                f'Only {len(kept_logic_cells)} of {len(self._logic_cells)} logic cells '
+                'are in the previous placement, placing from scratch')
+            return None
+        module_port_coords, kept_module_ports = self._keep_placement(
+            previous.module_port_coords,
+            self._io_block_sites,
+            self._module_ports,
+        )
+        state = self._make_state(logic_cell_coords, module_port_coords)
+        pinned = kept_logic_cells | kept_module_ports
+        if len(pinned) == len(self._logic_cells) + len(self._module_ports):
+            return state
+
+        print(f'Refining the previous placement ({len(kept_logic_cells)} of '
+              f'{len(self._logic_cells)} logic cells kept)')
+        # The moves are drawn from the global random generator.
+        random.seed(self.seeds[0])
+        annealer = RoutingAnnealer(self, state, pinned)
+        initial_energy = annealer.energy()
+        state, energy = annealer.anneal_adaptive(self.placement_schedule, refine=True)
+        print(f'Placement cost {initial_energy:g} refined to {energy:g}')
+        return state
+
+    def _keep_placement(self, previous_coords, all_coords, nodes):
+        """Place nodes at their previous locations, and new ones near them.
+
+        Returns the placement and the set of nodes which were kept.
 
+        """
+        placement = dict.fromkeys(all_coords)
+        placed_nodes = set(nodes)
+        locations = {}
+        for coords, node in previous_coords.items():
+            if coords in placement and node in placed_nodes:
+                placement[coords] = node
+                locations[node] = self._location(coords)
+        kept = set(locations)
+
+        graph = self.implementation.graph
+        free_coords = [coords for coords, node in placement.items() if node is None]
+        for node in nodes:
+            if node in locations:
+                continue
+            neighbors = itertools.chain(graph.predecessors(node), graph.successors(node))
+            neighbor_locations = [
+                locations[neighbor] for neighbor in neighbors
+                if neighbor in locations
+            ]
+            if neighbor_locations:
+                center = (
+                    statistics.mean(x for x, _y in neighbor_locations),
+                    statistics.mean(y for _x, y in neighbor_locations),
+                )
+                coords = min(
+                    free_coords,
+                    key=lambda coords: _distance(self._location(coords), center),
+                )
+            else:
+                coords = free_coords[0]
+            free_coords.remove(coords)
+            placement[coords] = node
+            locations[node] = self._location(coords)
+        return placement, kept
+
+    def _location(self, coords):
+        if isinstance(coords, LogicCellCoordinates):
+            return self.topology.node_position(coords.output)
+        else:
+            return self.topology.node_position(coords)
 
+    def _build_nets(self, state):
+        nets = {}
+        for driver in self._net_sinks:
+            source, sinks = _placed_net(self.network, self._net_sinks, state, driver)
+            nets[source] = sinks
+        return nets
+
+    def _route_nets(self, nets, *, workers=1, on_iteration=None, previous=None,
+                    on_checkpoint=None, resume=None):
+        # Routes from a previous solution can be kept for nets which still
+        # have exactly the same source and sinks.
+        initial_routes = {}
+        if previous is not None:
+            node_ids = self.network.node_ids
+            for source, sinks in previous.nets.items():
+                route = previous.routes[source]
+                if not all(node in node_ids for node in route):
+                    continue
+                source_id = node_ids[source]
+                if nets.get(source_id) == {node_ids[sink] for sink in sinks}:
+                    initial_routes[source_id] = {node_ids[node] for node in route}
+
+        return pathfinder.route(
+            self.network,
+            nets,
+            astar_factor=1,
+            bbox_margin=3,
+            workers=workers,
+            schedule=self.schedule,
+            on_iteration=on_iteration,
+            initial_routes=initial_routes,
+            on_checkpoint=on_checkpoint,
+            resume=resume,
+        )
 
-    import pdb; pdb.set_trace();  # TODO: remove me
-    pass
 
-    # routes = pathfinder.route(network, nets)
+def _netlist_digest(implementation):
+    """Digest the cells, ports and connections of an implementation.
 
+    Checkpoints are only resumed for the same digest, since their placements
+    refer to cells by index.
 
-    # return routes
+    """
+    digest = hashlib.sha256()
+    for node in sorted(repr(node) for node in implementation.graph.nodes):
+        digest.update(f'{node}\n'.encode())
+    edges = sorted(
+        (repr(source), repr(sink), repr(port))
+        for source, sink, port in implementation.graph.edges.data('port')
+    )
+    for edge in edges:
+        digest.update(f'{edge}\n'.encode())
+    return digest.hexdigest()
+
+
+# Annealing chains run in worker processes use the router sent to each
+# process when it starts, rather than pickling it for every chain.
+_worker_router = None
 
-    # for source, route in routes.items():
-    #     print(source)
-    #     print('-----------------------------------------------------')
-    #     for x in route:
-    #         print(x)
-    #     print('-----------------------------------------------------\n')
 
+def _init_worker(router):
+    global _worker_router
+    _worker_router = router
 
 
+def _anneal_chain(seed):
+    return _worker_router._anneal(seed)
 
 
+def _distance(location1, location2):
+    (x1, y1), (x2, y2) = location1, location2
+    return abs(x1 - x2) + abs(y1 - y2)
 
+
+def route_design(implementation, topology, previous=None, *, seeds=(0,), workers=1,
+                 placement_schedule=None, checkpoint_path=None, resume=False):
+    try:
+        checkpoint = None
+        if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+            print(f'Resuming from {checkpoint_path}')
+            checkpoint = Checkpoint.load(checkpoint_path)
+        router = Router(
+            implementation,
+            topology,
+            seeds=seeds,
+            workers=workers,
+            placement_schedule=placement_schedule,
+            checkpoint_path=checkpoint_path,
+            resume=checkpoint,
+        )
+        return router.solve(previous)
+    except KeyboardInterrupt:
+        print('Aborted')
+        return None
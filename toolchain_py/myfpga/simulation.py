@@ -1,14 +1,40 @@
 """Simulate an implemented design."""
 
+import copy
 import functools
+import itertools
 import operator
+from dataclasses import dataclass
 
 from myfpga.synthesis import ModulePort
 from myfpga.implementation import LogicCell
+from myfpga.waveform import VcdWriter
 
 import networkx as nx
 
 
+# Net states are packed into bitvectors by way of strings of binary digits.
+_STATE_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+_DIGIT_STATES = bytes.maketrans(b'01', b'\x00\x01')
+
+
+@dataclass(frozen=True)
+class SimulatorState:
+
+    """Snapshot of a simulation, to be restored by any simulator of the design.
+
+    `net_states` packs the state of each net into one bit, in the order of
+    the nodes of the implementation graph.
+
+    """
+
+    net_count: int
+    net_states: bytes
+    last_clock_state: bool
+    pending_flip_flop_updates: tuple
+    eval_count: int
+
+
 class Simulator:
 
     def __init__(self, implementation):
@@ -18,13 +44,16 @@ class Simulator:
         # Keep track of net states for the simulation.
         # We include module inputs as these drive nets,
         # but not module outputs as these are driven by other nets.
-        self.net_states = {
-            node: False for node in graph.nodes
+        self._state_nodes = [
+            node for node in graph.nodes
             if not (isinstance(node, ModulePort) and not node.is_input)
-        }
+        ]
+        self.net_states = {node: False for node in self._state_nodes}
         self.last_clock_state = False
         self.current_clock_state = False
         self.pending_flip_flop_updates = {}
+        self.eval_count = 0
+        self.waveform = None
 
         # Keep track of each node's source for the simulation,
         # including the output nodes we remove later.
@@ -91,27 +120,103 @@ class Simulator:
         return result
 
     def set_input(self, name, value):
+        self._input_setter(name)(value)
+
+    def get_output(self, name):
+        return self._output_getter(name)()
+
+    def _input_setter(self, name):
+        """Return a function which sets the value of an input port."""
         try:
             ports = self.inputs[name]
         except KeyError as exc:
             raise RuntimeError(f'No such input port "{name}"') from exc
-        else:
+
+        def set_value(value):
             for i, port in enumerate(ports):
                 bit_value = value & (1 << i)
                 self.net_states[port] = bool(bit_value)
+        return set_value
 
-    def get_output(self, name):
+    def _output_getter(self, name):
+        """Return a function which gets the value of an output port."""
         try:
             ports = self.outputs[name]
         except KeyError as exc:
             raise RuntimeError(f'No such output port "{name}"') from exc
-        else:
+        sources = []
+        for port in ports:
+            port_sources = self.node_sources[port]
+            assert len(port_sources) == 1
+            sources.append(port_sources[0])
+
+        def get_value():
             result = 0
-            for i, port in enumerate(ports):
-                port_sources = self.node_sources[port]
-                assert len(port_sources) == 1
-                result |= int(self.net_states[port_sources[0]]) << i
+            for i, source in enumerate(sources):
+                result |= int(self.net_states[source]) << i
             return result
+        return get_value
+
+    def run(self, cycles, stimulus=None, outputs=None):
+        """Run the design for a number of clock cycles.
+
+        `stimulus` maps input port names to iterables giving the value of
+        the port in each cycle, which is set before the rising clock edge.
+        Other inputs keep their values. In each cycle the clock input is
+        driven high and then low, with an eval after each, and then
+        the outputs are read.
+
+        Returns a dict mapping the names of the output ports, or only those
+        in `outputs` if given, to a list of their values after each cycle.
+
+        """
+        if stimulus is None:
+            stimulus = {}
+        if outputs is None:
+            outputs = list(self.outputs)
+
+        set_clock = self._clock_setter(stimulus)
+
+        # Look up the ports once rather than by name in every cycle.
+        inputs = [
+            (name, self._input_setter(name), iter(values))
+            for name, values in stimulus.items()
+        ]
+        traces = {name: [] for name in outputs}
+        getters = [
+            (self._output_getter(name), trace) for name, trace in traces.items()
+        ]
+
+        for cycle in range(cycles):
+            for name, set_value, values in inputs:
+                try:
+                    set_value(next(values))
+                except StopIteration:
+                    raise RuntimeError(
+                        f'Stimulus for "{name}" ended after {cycle} cycles') from None
+            if set_clock is not None:
+                set_clock(True)
+                self.eval()
+                set_clock(False)
+            self.eval()
+            for get_value, trace in getters:
+                trace.append(get_value())
+        return traces
+
+    def _clock_setter(self, stimulus):
+        """Return a function which sets the state of the clock input.
+
+        Returns None if the design has no clock.
+
+        """
+        clock_input_port = self.implementation.clock_input_port
+        if clock_input_port is None:
+            return None
+        if clock_input_port.name in stimulus:
+            raise RuntimeError(
+                f'Clock input "{clock_input_port.name}" cannot be given in stimulus')
+        set_value = self._input_setter(clock_input_port.name)
+        return lambda state: set_value(state << clock_input_port.bit_index)
 
     @property
     def is_rising_clock_edge(self):
@@ -121,6 +226,89 @@ class Simulator:
     def is_falling_clock_edge(self):
         return self.last_clock_state and not self.current_clock_state
 
+    def trace(self, file, **kwargs):
+        """Start recording a waveform of the simulation to a VCD file.
+
+        Returns the `VcdWriter`, which takes the rest of the arguments and
+        must be closed to finish recording.
+
+        """
+        if self.waveform is not None:
+            raise RuntimeError('A waveform is already being recorded')
+        self.waveform = VcdWriter(self, file, **kwargs)
+        self.waveform.sample(self.eval_count)
+        return self.waveform
+
+    def _state_getter(self, nodes):
+        """Return a function which gets the states of nets as bytes of 0 or 1.
+
+        Also returns the position of the state of each of the nets in them.
+
+        """
+        nodes = list(nodes)
+        gather = _gatherer(nodes)
+        return lambda: bytes(gather(self.net_states)), range(len(nodes))
+
+    def snapshot(self):
+        """Return the state of the simulation as a `SimulatorState`."""
+        states = self._get_state_bytes()
+        pending_flip_flop_updates = ()
+        if self.pending_flip_flop_updates:
+            node_ids = {node: i for i, node in enumerate(self._state_nodes)}
+            pending_flip_flop_updates = tuple(
+                (node_ids[node], state)
+                for node, state in self.pending_flip_flop_updates.items()
+            )
+        return SimulatorState(
+            net_count=len(states),
+            net_states=_pack_states(states),
+            last_clock_state=self.last_clock_state,
+            pending_flip_flop_updates=pending_flip_flop_updates,
+            eval_count=self.eval_count,
+        )
+
+    def restore(self, state):
+        """Restore the simulation to a state returned by `snapshot`.
+
+        The state can come from any simulator of the same implementation.
+        Input ports are restored too.
+
+        """
+        if state.net_count != len(self._state_nodes):
+            raise ValueError('Simulator state is for a different implementation')
+        self._set_state_bytes(_unpack_states(state.net_states, state.net_count))
+        self.last_clock_state = state.last_clock_state
+        self.current_clock_state = state.last_clock_state
+        self.pending_flip_flop_updates = {
+            self._state_nodes[i]: net_state
+            for i, net_state in state.pending_flip_flop_updates
+        }
+        self.eval_count = state.eval_count
+
+    def fork(self):
+        """Return a copy of the simulator which continues independently.
+
+        Waveform recording is not copied.
+
+        """
+        forked = copy.copy(self)
+        forked.waveform = None
+        forked.restore(self.snapshot())
+        return forked
+
+    def _get_state_bytes(self):
+        """Get the state of each net as bytes of 0 or 1, in snapshot order."""
+        return bytes(_gatherer(self._state_nodes)(self.net_states))
+
+    def _set_state_bytes(self, states):
+        self.net_states = dict(zip(self._state_nodes, map(bool, states)))
+
+    def _finish_eval(self):
+        self.last_clock_state = self.current_clock_state
+        self.eval_count += 1
+        if self.waveform is not None:
+            self.waveform.sample(self.eval_count)
+
     def _simulate_logic_cell(self, logic_cell):
         # Simulate the LUT
         input_sources = self.node_sources[logic_cell]
@@ -144,7 +332,9 @@ class Simulator:
             self.net_states[logic_cell] = lut_output
 
     def eval(self):
-        self.current_clock_state = self.net_states[self.implementation.clock_input_port]
+        clock_input_port = self.implementation.clock_input_port
+        self.current_clock_state = (
+            clock_input_port is not None and self.net_states[clock_input_port])
 
         for logic_cell in self.eval_order:
             self._simulate_logic_cell(logic_cell)
@@ -154,4 +344,623 @@ class Simulator:
         self.net_states.update(self.pending_flip_flop_updates)
         self.pending_flip_flop_updates.clear()
 
-        self.last_clock_state = self.current_clock_state
+        self._finish_eval()
+
+
+class _IndexedSimulator(Simulator):
+
+    """Simulator holding net states in a list indexed by net ID.
+
+    Net states are held as 0 or 1 in the `values` bytearray, indexed by
+    `net_ids`, so `net_states` is only a copy of them.
+
+    """
+
+    def __init__(self, implementation):
+        super().__init__(implementation)
+        self._index_ports()
+
+    @property
+    def net_states(self):
+        return {node: bool(self.values[i]) for node, i in self.net_ids.items()}
+
+    @net_states.setter
+    def net_states(self, net_states):
+        self.net_ids = {node: i for i, node in enumerate(net_states)}
+        self.values = bytearray(int(state) for state in net_states.values())
+
+    def _index_ports(self):
+        self._state_ids = [self.net_ids[node] for node in self._state_nodes]
+        self._gather_states = _gatherer(self._state_ids)
+        self._input_ids = {
+            name: [self.net_ids[port] for port in ports]
+            for name, ports in self.inputs.items()
+        }
+        self._output_ids = {
+            name: [self.net_ids[self.node_sources[port][0]] for port in ports]
+            for name, ports in self.outputs.items()
+        }
+        clock_input_port = self.implementation.clock_input_port
+        self._clock_id = (
+            None if clock_input_port is None else self.net_ids[clock_input_port])
+
+    def _state_getter(self, nodes):
+        # Copying all of the states is faster than gathering some of them.
+        return lambda: bytes(self.values), [self.net_ids[node] for node in nodes]
+
+    def _get_state_bytes(self):
+        return bytes(self._gather_states(self.values))
+
+    def _set_state_bytes(self, states):
+        values = bytearray(len(self.values))
+        for net_id, net_state in zip(self._state_ids, states):
+            values[net_id] = net_state
+        self.values = values
+
+    def _find_levels(self):
+        """Group the combinational logic cells into dependency levels.
+
+        Each cell only depends on cells in earlier levels,
+        flip flops and module inputs.
+
+        """
+        levels = []
+        cell_levels = {}
+        for cell in self.eval_order:
+            if cell.ff is None:
+                level = max(
+                    (cell_levels[source] + 1 for source in self.node_sources[cell]
+                     if source in cell_levels),
+                    default=0,
+                )
+                cell_levels[cell] = level
+                if level == len(levels):
+                    levels.append([])
+                levels[level].append(cell)
+        return levels
+
+    def _input_setter(self, name):
+        try:
+            net_ids = self._input_ids[name]
+        except KeyError as exc:
+            raise RuntimeError(f'No such input port "{name}"') from exc
+
+        def set_value(value):
+            values = self.values
+            for i, net_id in enumerate(net_ids):
+                values[net_id] = (value >> i) & 1
+        return set_value
+
+    def _output_getter(self, name):
+        try:
+            net_ids = self._output_ids[name]
+        except KeyError as exc:
+            raise RuntimeError(f'No such output port "{name}"') from exc
+
+        def get_value():
+            values = self.values
+            result = 0
+            for i, net_id in enumerate(net_ids):
+                result |= values[net_id] << i
+            return result
+        return get_value
+
+
+class CompiledSimulator(_IndexedSimulator):
+
+    """Simulator which runs Python code generated from the netlist.
+
+    The netlist is turned into the source of one function for each kind of
+    clock edge (rising, falling or none). In each function every net is a
+    local variable and every LUT is a shift and a mask of its config,
+    in evaluation order. Functions are compiled once for each distinct
+    netlist and shared between simulators.
+
+    """
+
+    # Parameters of the generated functions, the first being the net values.
+    _parameters = 'v'
+
+    def __init__(self, implementation):
+        super().__init__(implementation)
+        functions = _compile_functions(self.generate_source())
+        self._eval_rising = functions['eval_rising']
+        self._eval_falling = functions['eval_falling']
+        self._eval_steady = functions['eval_steady']
+
+    def generate_source(self):
+        """Generate the source of the functions evaluating the netlist."""
+        return '\n'.join([
+            self._generate_function('eval_rising', rising_edge=True),
+            self._generate_function('eval_falling', rising_edge=False),
+            self._generate_function('eval_steady', rising_edge=None),
+        ])
+
+    def _generate_function(self, name, *, rising_edge):
+        # Flip flops triggered by the edge are updated at the end,
+        # the others are left alone, as is the LUT in front of them.
+        net_names = ', '.join(f'n{i}' for i in range(len(self.net_ids)))
+        lines = [f'def {name}({self._parameters}):']
+        if net_names:
+            lines.append(f'    {net_names}, = v')
+        flip_flop_ids = []
+        for logic_cell in self.eval_order:
+            i = self.net_ids[logic_cell]
+            expression = self._lut_expression(
+                logic_cell.lut.config,
+                [f'n{self.net_ids[source]}' for source in self.node_sources[logic_cell]],
+            )
+            if logic_cell.ff is None:
+                lines.append(f'    n{i} = {expression}')
+            elif logic_cell.ff.rising_edge_trigger == rising_edge:
+                lines.append(f'    d{i} = {expression}')
+                flip_flop_ids.append(i)
+        for i in flip_flop_ids:
+            lines.append(f'    n{i} = d{i}')
+        if net_names:
+            lines.append(f'    v[:] = {net_names},')
+        lines.append('')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _lut_expression(config, inputs):
+        if not inputs:
+            return str(config & 1)
+        index = ' | '.join(
+            f'{name} << {i}' if i else name for i, name in enumerate(inputs))
+        return f'{config:#x} >> ({index}) & 1'
+
+    def eval(self):
+        self.current_clock_state = (
+            self._clock_id is not None and bool(self.values[self._clock_id]))
+
+        if self.is_rising_clock_edge:
+            self._eval_rising(self.values)
+        elif self.is_falling_clock_edge:
+            self._eval_falling(self.values)
+        else:
+            self._eval_steady(self.values)
+
+        self._finish_eval()
+
+
+class BitParallelSimulator(CompiledSimulator):
+
+    """Simulator which runs many independent input vectors at once.
+
+    Each net holds an integer with one bit for each vector, bit `j`
+    being the state of the net in vector `j`, so a single pass through
+    the generated code evaluates every vector. LUTs are evaluated by
+    Shannon expansion of their config into bitwise operations.
+
+    Inputs and outputs are given as lists with one value for each vector,
+    or as one integer of vector bits for each port bit by `set_input_bits`
+    and `get_output_bits`. An input can also be set to one value for all
+    vectors. The clock input must be the same in all vectors. Input values
+    may be of any integer type, such as NumPy's, and are converted to
+    Python integers, so that vector bits are not lost to fixed widths.
+
+    """
+
+    _parameters = 'v, m'
+
+    def __init__(self, implementation, vectors=64):
+        if vectors < 1:
+            raise ValueError('There must be at least one vector')
+        self.vectors = vectors
+        self.mask = (1 << vectors) - 1
+        super().__init__(implementation)
+
+    @property
+    def net_states(self):
+        return {node: self.values[i] for node, i in self.net_ids.items()}
+
+    @net_states.setter
+    def net_states(self, net_states):
+        self.net_ids = {node: i for i, node in enumerate(net_states)}
+        self.values = [self.mask if state else 0 for state in net_states.values()]
+
+    @staticmethod
+    def _lut_expression(config, inputs):
+        # Expand on the last input, which selects between the upper and lower
+        # halves of the truth table, simplifying where a half is constant or
+        # the input makes no difference.
+        if not inputs:
+            return 'm' if config & 1 else '0'
+        *rest, name = inputs
+        half = 1 << len(rest)
+        low = BitParallelSimulator._lut_expression(config, rest)
+        high = BitParallelSimulator._lut_expression(config >> half, rest)
+        if low == high:
+            return low
+        if (low, high) == ('0', 'm'):
+            return name
+        if (low, high) == ('m', '0'):
+            return f'({name} ^ m)'
+        if low == '0':
+            return f'({name} & {high})'
+        if high == '0':
+            return f'({low} & ~{name})'
+        if low == 'm':
+            return f'({high} | {name} ^ m)'
+        if high == 'm':
+            return f'({name} | {low})'
+        return f'({name} & {high} | {low} & ~{name})'
+
+    def set_input(self, name, values):
+        try:
+            values = [operator.index(values)] * self.vectors
+        except TypeError:
+            values = [operator.index(value) for value in values]
+        if len(values) != self.vectors:
+            raise ValueError(f'Expected {self.vectors} values, got {len(values)}')
+        try:
+            width = len(self._input_ids[name])
+        except KeyError as exc:
+            raise RuntimeError(f'No such input port "{name}"') from exc
+        self.set_input_bits(name, [
+            sum(((value >> i) & 1) << j for j, value in enumerate(values))
+            for i in range(width)
+        ])
+
+    def set_input_bits(self, name, words):
+        """Set each bit of an input port to an integer of vector bits."""
+        try:
+            net_ids = self._input_ids[name]
+        except KeyError as exc:
+            raise RuntimeError(f'No such input port "{name}"') from exc
+        else:
+            if len(words) != len(net_ids):
+                raise ValueError(
+                    f'Input port "{name}" has {len(net_ids)} bits, got {len(words)}')
+            for net_id, word in zip(net_ids, words):
+                self.values[net_id] = operator.index(word) & self.mask
+
+    def get_output(self, name):
+        words = self.get_output_bits(name)
+        return [
+            sum(((word >> j) & 1) << i for i, word in enumerate(words))
+            for j in range(self.vectors)
+        ]
+
+    def _state_getter(self, nodes):
+        # Waveforms are recorded for the first vector.
+        nodes = list(nodes)
+        gather = _gatherer([self.net_ids[node] for node in nodes])
+        get_states = lambda: bytes(  # noqa: E731
+            map(operator.and_, gather(self.values), itertools.repeat(1)))
+        return get_states, range(len(nodes))
+
+    def _get_state_bytes(self):
+        words = self._gather_states(self.values)
+        if any(word not in (0, self.mask) for word in words):
+            raise RuntimeError('Cannot take a snapshot unless all vectors are the same')
+        return bytes(word & 1 for word in words)
+
+    def _set_state_bytes(self, states):
+        # The state is restored into every vector.
+        values = [0] * len(self.values)
+        for net_id, net_state in zip(self._state_ids, states):
+            values[net_id] = self.mask if net_state else 0
+        self.values = values
+
+    def _input_setter(self, name):
+        if name not in self._input_ids:
+            raise RuntimeError(f'No such input port "{name}"')
+        return functools.partial(self.set_input, name)
+
+    def _output_getter(self, name):
+        if name not in self._output_ids:
+            raise RuntimeError(f'No such output port "{name}"')
+        return functools.partial(self.get_output, name)
+
+    def get_output_bits(self, name):
+        """Get an integer of vector bits for each bit of an output port."""
+        try:
+            net_ids = self._output_ids[name]
+        except KeyError as exc:
+            raise RuntimeError(f'No such output port "{name}"') from exc
+        else:
+            return [self.values[net_id] for net_id in net_ids]
+
+    def eval(self):
+        clock = 0 if self._clock_id is None else self.values[self._clock_id]
+        if clock not in (0, self.mask):
+            raise RuntimeError('The clock input must be the same in all vectors')
+        self.current_clock_state = bool(clock)
+
+        if self.is_rising_clock_edge:
+            self._eval_rising(self.values, self.mask)
+        elif self.is_falling_clock_edge:
+            self._eval_falling(self.values, self.mask)
+        else:
+            self._eval_steady(self.values, self.mask)
+
+        self._finish_eval()
+
+
+@dataclass
+class _LutGroup:
+    start: int
+    stop: int
+    configs: list
+    inputs: list
+
+    def evaluate(self, values):
+        """Iterate the LUT outputs of the group from the current net values."""
+        if not self.inputs:
+            return [config & 1 for config in self.configs]
+        gather, *others = self.inputs
+        index = gather(values)
+        for shift, gather in enumerate(others, 1):
+            index = map(operator.or_, index,
+                        map(operator.lshift, gather(values), itertools.repeat(shift)))
+        return map(operator.and_,
+                   map(operator.rshift, self.configs, index), itertools.repeat(1))
+
+
+class LevelizedSimulator(_IndexedSimulator):
+
+    """Simulator which evaluates whole levels of the netlist at once.
+
+    Combinational logic cells are grouped into levels where each cell only
+    depends on cells in earlier levels, flip flops and module inputs.
+    Nets are numbered so that the outputs of each level are a contiguous
+    slice of `values`, so a level is evaluated by gathering each input of
+    every cell, combining them into LUT config indexes, shifting the configs
+    and assigning the results to the slice, all without a Python loop over
+    the cells.
+
+    The flip flops triggered by each clock edge are grouped in the same way
+    and evaluated after the last level.
+
+    """
+
+    def __init__(self, implementation):
+        super().__init__(implementation)
+        rising_flip_flops = [
+            cell for cell in self.eval_order
+            if cell.ff is not None and cell.ff.rising_edge_trigger
+        ]
+        falling_flip_flops = [
+            cell for cell in self.eval_order
+            if cell.ff is not None and not cell.ff.rising_edge_trigger
+        ]
+        levels = self._find_levels()
+
+        # Renumber the nets so that each group of cells is contiguous,
+        # followed by a net which is always 0 for LUTs with unused inputs.
+        cells = set(self.eval_order)
+        order = [node for node in self.net_ids if node not in cells]
+        groups = []
+        for group_cells in [rising_flip_flops, falling_flip_flops, *levels]:
+            groups.append((len(order), group_cells))
+            order.extend(group_cells)
+        self.net_states = {node: False for node in order}
+        self._index_ports()
+
+        self._rising_group, self._falling_group, *self._levels = [
+            self._make_group(start, group_cells) for start, group_cells in groups
+        ]
+
+    @_IndexedSimulator.net_states.setter
+    def net_states(self, net_states):
+        _IndexedSimulator.net_states.fset(self, net_states)
+        self.values.append(0)
+
+    def _make_group(self, start, cells):
+        zero_id = len(self.values) - 1
+        width = max((len(self.node_sources[cell]) for cell in cells), default=0)
+        inputs = []
+        for i in range(width):
+            net_ids = [
+                self.net_ids[sources[i]] if i < len(sources) else zero_id
+                for sources in (self.node_sources[cell] for cell in cells)
+            ]
+            inputs.append(_gatherer(net_ids))
+        return _LutGroup(
+            start=start,
+            stop=start + len(cells),
+            configs=[cell.lut.config for cell in cells],
+            inputs=inputs,
+        )
+
+    def eval(self):
+        self.current_clock_state = (
+            self._clock_id is not None and bool(self.values[self._clock_id]))
+
+        values = self.values
+        for level in self._levels:
+            values[level.start:level.stop] = level.evaluate(values)
+
+        # The flip flops are evaluated after all of the combinational logic
+        # and updated together, so they only see the previous flip flop states.
+        if self.is_rising_clock_edge:
+            group = self._rising_group
+        elif self.is_falling_clock_edge:
+            group = self._falling_group
+        else:
+            group = None
+        if group is not None:
+            values[group.start:group.stop] = group.evaluate(values)
+
+        self._finish_eval()
+
+
+class EventDrivenSimulator(_IndexedSimulator):
+
+    """Simulator which only evaluates logic cells whose inputs changed.
+
+    A logic cell is marked dirty when one of its input nets changes,
+    and each eval only evaluates the dirty cells, in level order so that
+    each is evaluated at most once. The cost of an eval is then in
+    proportion to the switching activity rather than the size of the design.
+
+    The LUT output of each flip flop is kept up to date in the same way,
+    and flip flops whose LUT output differs from their state are tracked,
+    so a clock edge only updates those which change. The cells they drive
+    are then evaluated by the next eval.
+
+    """
+
+    def __init__(self, implementation):
+        super().__init__(implementation)
+        levels = self._find_levels()
+        net_count = len(self.values)
+        self._levels = [None] * net_count
+        self._cell_inputs = [None] * net_count
+        self._configs = [0] * net_count
+        self._rising_edge_triggers = [None] * net_count
+        self._fanouts = [[] for _ in range(net_count)]
+        for level, cells in enumerate(levels + [
+            [cell for cell in self.eval_order if cell.ff is not None],
+        ]):
+            for cell in cells:
+                i = self.net_ids[cell]
+                self._levels[i] = level
+                self._cell_inputs[i] = tuple(
+                    self.net_ids[source] for source in self.node_sources[cell])
+                self._configs[i] = cell.lut.config
+                if cell.ff is not None:
+                    self._rising_edge_triggers[i] = cell.ff.rising_edge_trigger
+                for source_id in set(self._cell_inputs[i]):
+                    self._fanouts[source_id].append(i)
+
+        # The flip flops are in the last level.
+        self._level_count = len(levels) + 1
+        self._reset_events()
+
+    @_IndexedSimulator.net_states.setter
+    def net_states(self, net_states):
+        _IndexedSimulator.net_states.fset(self, net_states)
+        if hasattr(self, '_level_count'):
+            self._reset_events()
+
+    def _set_state_bytes(self, states):
+        super()._set_state_bytes(states)
+        self._reset_events()
+
+    def _reset_events(self):
+        """Mark every cell dirty after all of the net states have been replaced."""
+        net_count = len(self.values)
+        self._dirty_cells = [[] for _ in range(self._level_count)]
+        self._is_dirty = bytearray(net_count)
+        self._flip_flop_inputs = [0] * net_count
+        self._changed_flip_flops = set()
+        for i, level in enumerate(self._levels):
+            if level is not None:
+                self._mark_dirty(i)
+
+    def _mark_dirty(self, cell_id):
+        if not self._is_dirty[cell_id]:
+            self._is_dirty[cell_id] = 1
+            self._dirty_cells[self._levels[cell_id]].append(cell_id)
+
+    def _mark_fanouts_dirty(self, net_id):
+        for cell_id in self._fanouts[net_id]:
+            self._mark_dirty(cell_id)
+
+    def _input_setter(self, name):
+        try:
+            net_ids = self._input_ids[name]
+        except KeyError as exc:
+            raise RuntimeError(f'No such input port "{name}"') from exc
+
+        def set_value(value):
+            values = self.values
+            for i, net_id in enumerate(net_ids):
+                bit = (value >> i) & 1
+                if values[net_id] != bit:
+                    values[net_id] = bit
+                    self._mark_fanouts_dirty(net_id)
+        return set_value
+
+    def _evaluate_dirty_cells(self):
+        values = self.values
+        is_dirty = self._is_dirty
+        cell_inputs = self._cell_inputs
+        configs = self._configs
+        flip_flop_inputs = self._flip_flop_inputs
+        changed_flip_flops = self._changed_flip_flops
+        *levels, flip_flops = self._dirty_cells
+
+        # Cells only drive cells in later levels, which may be appended to
+        # while this level is evaluated.
+        for cells in levels:
+            for cell_id in cells:
+                is_dirty[cell_id] = 0
+                index = 0
+                for shift, source_id in enumerate(cell_inputs[cell_id]):
+                    index |= values[source_id] << shift
+                output = (configs[cell_id] >> index) & 1
+                if values[cell_id] != output:
+                    values[cell_id] = output
+                    self._mark_fanouts_dirty(cell_id)
+            cells.clear()
+
+        for cell_id in flip_flops:
+            is_dirty[cell_id] = 0
+            index = 0
+            for shift, source_id in enumerate(cell_inputs[cell_id]):
+                index |= values[source_id] << shift
+            output = (configs[cell_id] >> index) & 1
+            flip_flop_inputs[cell_id] = output
+            if values[cell_id] != output:
+                changed_flip_flops.add(cell_id)
+            else:
+                changed_flip_flops.discard(cell_id)
+        flip_flops.clear()
+
+    def _update_flip_flops(self, rising_edge):
+        triggered = [
+            cell_id for cell_id in self._changed_flip_flops
+            if self._rising_edge_triggers[cell_id] == rising_edge
+        ]
+        for cell_id in triggered:
+            self.values[cell_id] = self._flip_flop_inputs[cell_id]
+            self._changed_flip_flops.discard(cell_id)
+            self._mark_fanouts_dirty(cell_id)
+
+    def eval(self):
+        self.current_clock_state = (
+            self._clock_id is not None and bool(self.values[self._clock_id]))
+
+        self._evaluate_dirty_cells()
+
+        # Update the flip flops together at the end of the step,
+        # so the cells they drive are only evaluated by the next step.
+        if self.is_rising_clock_edge:
+            self._update_flip_flops(True)
+        elif self.is_falling_clock_edge:
+            self._update_flip_flops(False)
+
+        self._finish_eval()
+
+
+def _pack_states(states):
+    """Pack bytes of 0 or 1 into a bitvector."""
+    digits = states.translate(_STATE_DIGITS)[::-1]
+    return int(digits or b'0', 2).to_bytes((len(states) + 7) // 8, 'little')
+
+
+def _unpack_states(data, count):
+    """Unpack a bitvector into bytes of 0 or 1."""
+    digits = format(int.from_bytes(data, 'little'), f'0{count}b').encode()
+    return digits[::-1][:count].translate(_DIGIT_STATES)
+
+
+def _gatherer(net_ids):
+    """Return a function which gets a tuple of the values of the given nets."""
+    if not net_ids:
+        return lambda values: ()
+    if len(net_ids) == 1:
+        net_id, = net_ids
+        return lambda values: (values[net_id],)
+    return operator.itemgetter(*net_ids)
+
+
+@functools.lru_cache(maxsize=16)
+def _compile_functions(source):
+    namespace = {}
+    exec(compile(source, '<generated simulation>', 'exec'), namespace)
+    return namespace
@@ -0,0 +1,127 @@
+"""Check implemented designs against the synthesized netlist."""
+
+import random
+from dataclasses import dataclass
+from typing import Optional
+
+import networkx as nx
+
+from myfpga.synthesis import LookUpTable, FlipFlop, FlipFlopInputPort, ModulePort
+from myfpga.implementation import LogicCell, Implementation
+from myfpga.simulation import BitParallelSimulator
+
+
+# Config of a LUT whose output is its first input.
+_IDENTITY_CONFIG = 0xaaaa
+
+
+class DesignNetlist:
+
+    """Netlist of a design with each LUT and flip flop in its own logic cell.
+
+    This has the same interface as an `Implementation` so it can be
+    simulated, but leaves out the merging of LUTs and flip flops so that
+    the implementation can be checked against it.
+
+    """
+
+    def __init__(self, design):
+        self.design = design
+        source_graph = design.build_graph()
+        self.clock_input_port = Implementation._sanity_check_flip_flops(source_graph)
+
+        cells = {}
+        for node in source_graph.nodes:
+            if isinstance(node, LookUpTable):
+                cells[node] = LogicCell(lut=node, ff=None)
+            elif isinstance(node, FlipFlop):
+                lut = LookUpTable(name=node.name, config=_IDENTITY_CONFIG)
+                cells[node] = LogicCell(lut=lut, ff=node)
+            elif not isinstance(node, ModulePort):
+                raise NotImplementedError(node)
+
+        self.graph = nx.DiGraph()
+        self.graph.add_nodes_from(cells.get(node, node) for node in source_graph.nodes)
+        for source, sink, port in source_graph.edges.data('port'):
+            if port is FlipFlopInputPort.data:
+                port = 0
+            elif port is FlipFlopInputPort.clock:
+                port = 'clock'
+            attrs = {} if port is None else {'port': port}
+            self.graph.add_edge(cells.get(source, source), cells.get(sink, sink), **attrs)
+
+
+@dataclass
+class EquivalenceMismatch:
+    output: str
+    cycle: int
+    clock_state: bool
+    vector: int
+    design_value: int
+    implementation_value: int
+
+    def __str__(self):
+        edge = 'rising' if self.clock_state else 'falling'
+        return (
+            f'Output "{self.output}" differs after the {edge} clock edge of cycle '
+            f'{self.cycle}: design gives {self.design_value}, '
+            f'implementation gives {self.implementation_value}'
+        )
+
+
+def check_equivalence(implementation, *, cycles=1000, vectors=1024,
+                      seed=0) -> Optional[EquivalenceMismatch]:
+    """Check that an implementation behaves the same as its design.
+
+    The design netlist and the implementation are simulated side by side
+    with the same random inputs, many vectors at a time, and their outputs
+    are compared after each clock edge. Returns the first mismatch, in the
+    earliest cycle and then the lowest vector, or None if there is none.
+
+    """
+    netlist = DesignNetlist(implementation.design)
+    design_simulator = BitParallelSimulator(netlist, vectors)
+    implementation_simulator = BitParallelSimulator(implementation, vectors)
+    simulators = [design_simulator, implementation_simulator]
+    mask = design_simulator.mask
+
+    clock_input_port = implementation.clock_input_port
+    inputs = {
+        name: len(ports) for name, ports in design_simulator.inputs.items()
+        if clock_input_port is None or name != clock_input_port.name
+    }
+    outputs = list(design_simulator.outputs)
+
+    rng = random.Random(seed)
+    for cycle in range(cycles):
+        for name, width in inputs.items():
+            words = [rng.getrandbits(vectors) for _bit in range(width)]
+            for simulator in simulators:
+                simulator.set_input_bits(name, words)
+
+        for clock_state in [True, False]:
+            for simulator in simulators:
+                if clock_input_port is not None:
+                    clock = int(clock_state) << clock_input_port.bit_index
+                    simulator.set_input(clock_input_port.name, clock)
+                simulator.eval()
+
+            for name in outputs:
+                design_words = design_simulator.get_output_bits(name)
+                implementation_words = implementation_simulator.get_output_bits(name)
+                differences = 0
+                for design_word, implementation_word in zip(
+                        design_words, implementation_words):
+                    differences |= design_word ^ implementation_word
+                if differences & mask:
+                    vector = (differences & -differences).bit_length() - 1
+                    return EquivalenceMismatch(
+                        output=name,
+                        cycle=cycle,
+                        clock_state=clock_state,
+                        vector=vector,
+                        design_value=design_simulator.get_output(name)[vector],
+                        implementation_value=(
+                            implementation_simulator.get_output(name)[vector]),
+                    )
+    return None
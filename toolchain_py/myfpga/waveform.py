@@ -0,0 +1,178 @@
+"""Record simulated waveforms."""
+
+
+# Identifier codes are made of the printable ASCII characters.
+_FIRST_ID_CHARACTER = 33
+_ID_CHARACTERS = 94
+
+
+class VcdWriter:
+
+    """Record the nets of a simulation to a Value Change Dump file.
+
+    The simulator samples the writer after every eval, which is one unit
+    of time. Only the signals which changed since the previous sample are
+    recorded, and records are buffered in memory and written to the file
+    in chunks of `buffer_size` samples.
+
+    Signals are the module ports, named as in the design, and the outputs
+    of logic cells, named after their flip flop or otherwise their LUT.
+    `signals` selects a subset of them by name, and only samples from
+    `start` up to and including `stop` are recorded.
+
+    The writer must be closed to write out the buffered records.
+
+    """
+
+    def __init__(self, simulator, file, *, signals=None, start=0, stop=None,
+                 buffer_size=4096):
+        self.simulator = simulator
+        self.file = file
+        self.start = start
+        self.stop = stop
+        self.buffer_size = buffer_size
+
+        available = self._find_signals(simulator)
+        if signals is None:
+            signals = list(available)
+        self.signals = []
+        for name in signals:
+            try:
+                scope, nets = available[name]
+            except KeyError as exc:
+                raise RuntimeError(f'No such signal "{name}"') from exc
+            self.signals.append((name, scope, nets))
+
+        # The simulator gives the states of all of the nets at once,
+        # so find the position of each net and map it back to its signal.
+        nets = [net for _name, _scope, signal_nets in self.signals for net in signal_nets]
+        self._get_states, positions = simulator._state_getter(nets)
+        positions = iter(positions)
+        self._positions = [
+            [next(positions) for _net in signal_nets]
+            for _name, _scope, signal_nets in self.signals
+        ]
+        # A net can be in more than one signal, such as an output port
+        # and the logic cell driving it.
+        self._position_signals = {}
+        for i, signal_positions in enumerate(self._positions):
+            for position in signal_positions:
+                self._position_signals.setdefault(position, []).append(i)
+        self._identifiers = [self._identifier(i) for i in range(len(self.signals))]
+
+        self._previous = None
+        self._buffer = []
+        self._buffered_samples = 0
+        self._write_header()
+
+    @staticmethod
+    def _find_signals(simulator):
+        """Find the nets of each signal by name, with its scope."""
+        signals = {}
+        for name, ports in simulator.inputs.items():
+            signals[name] = ('ports', ports)
+        for name, ports in simulator.outputs.items():
+            signals[name] = (
+                'ports', [simulator.node_sources[port][0] for port in ports])
+
+        for cell in simulator.eval_order:
+            name = cell.lut.name if cell.ff is None else cell.ff.name
+            # Passthrough LUTs share a name.
+            unique_name = name
+            suffix = 1
+            while unique_name in signals:
+                suffix += 1
+                unique_name = f'{name}#{suffix}'
+            signals[unique_name] = ('cells', [cell])
+        return signals
+
+    @staticmethod
+    def _identifier(i):
+        characters = []
+        while True:
+            i, remainder = divmod(i, _ID_CHARACTERS)
+            characters.append(chr(_FIRST_ID_CHARACTER + remainder))
+            if i == 0:
+                return ''.join(characters)
+
+    def _write_header(self):
+        design_name = self.simulator.implementation.design.name
+        lines = [
+            '$version myfpga simulation $end',
+            '$timescale 1ns $end',
+            f'$scope module {design_name} $end',
+        ]
+        for scope in ['ports', 'cells']:
+            lines.append(f'$scope module {scope} $end')
+            for i, (name, signal_scope, nets) in enumerate(self.signals):
+                if signal_scope == scope:
+                    name = name.replace(' ', '_')
+                    lines.append(
+                        f'$var wire {len(nets)} {self._identifiers[i]} {name} $end')
+            lines.append('$upscope $end')
+        lines.append('$upscope $end')
+        lines.append('$enddefinitions $end')
+        self.file.write('\n'.join(lines) + '\n')
+
+    def _format_value(self, i, states):
+        positions = self._positions[i]
+        identifier = self._identifiers[i]
+        if len(positions) == 1:
+            return f'{states[positions[0]]}{identifier}'
+        bits = ''.join(str(states[position]) for position in reversed(positions))
+        return f'b{bits} {identifier}'
+
+    def sample(self, time):
+        """Record the signals which changed at a time."""
+        if time < self.start or (self.stop is not None and time > self.stop):
+            return
+        states = self._get_states()
+        previous = self._previous
+        if states == previous:
+            return
+        self._previous = states
+
+        if previous is None:
+            lines = [f'#{time}', '$dumpvars']
+            lines.extend(
+                self._format_value(i, states) for i in range(len(self.signals)))
+            lines.append('$end')
+        else:
+            # Search for the changed nets rather than looping over all of them.
+            changes = (
+                int.from_bytes(states, 'little') ^ int.from_bytes(previous, 'little')
+            ).to_bytes(len(states), 'little')
+            position_signals = self._position_signals
+            changed_signals = set()
+            position = changes.find(1)
+            while position >= 0:
+                if position in position_signals:
+                    changed_signals.update(position_signals[position])
+                position = changes.find(1, position + 1)
+            if not changed_signals:
+                return
+            lines = [f'#{time}']
+            lines.extend(self._format_value(i, states) for i in sorted(changed_signals))
+        self._buffer.append('\n'.join(lines) + '\n')
+
+        self._buffered_samples += 1
+        if self._buffered_samples >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to the file."""
+        self.file.write(''.join(self._buffer))
+        self._buffer.clear()
+        self._buffered_samples = 0
+
+    def close(self):
+        """Write the buffered records and stop recording the simulation."""
+        self.flush()
+        if self.simulator.waveform is self:
+            self.simulator.waveform = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()